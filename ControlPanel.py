@@ -1,12 +1,24 @@
 from tkinter import *
+from groups import STANDARD_GROUPS
+from keyagreement import KEX
+from history import INVALID, RECEIVED, SENT, MessageHistory
+from messagelog import MessageLog
+from protocol import STATES
 import json
+import os
+import queue
 
-UI_STATES = ["select_user", "pick_shared", "pick_secret", "awaiting_public", "show_keys", "messaging"]
+EVENT_INTERVAL = 50  # Milliseconds between handling queued events
+MAX_EVENTS = 500  # Largest number of queued events handled at once, so a flood can't block the main loop
+MESSAGE_ROWS = 9  # Largest number of messages visible at once, each shown by a reused label
+ROW_PADDING = 5  # Pixels between message rows
+WRAP_LENGTH = 470  # Longer messages are wrapped onto more lines, making their row taller
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))  # The UI config is read from next to this file, not the working directory
 
-with open("defaultValues.json", "r") as f:
+with open(os.path.join(CONFIG_DIR, "defaultValues.json"), "r") as f:
     DEFAULT_VALUES = json.loads(f.read())
 
-with open("colors.json") as f:
+with open(os.path.join(CONFIG_DIR, "colors.json")) as f:
     COLORS = json.loads(f.read())
 
 
@@ -17,7 +29,7 @@ class ControlPanel(Tk):
 
     def __init__(self, DH):
         super().__init__()
-        self._state = UI_STATES[0]  # Current state of the program
+        self._state = STATES[0]  # Current state of the program
         self.DH = DH  # The Diffie-Hellman object, used to get/set values
         self.temp_items = []  # Temporary items to be removed when switching screens
         self.name_label = Label(self, text="", fg=COLORS["text"], font="Rockwell 22", bg=COLORS["background"])  # Label for the name of the user
@@ -39,7 +51,20 @@ class ControlPanel(Tk):
             highlightbackground=COLORS["accent"]
         )
         self.message_canvas.pack_propagate(False)  # Don't allow the canvas to change size
-        self.message_list = []  # List of all currently displayed messages
+        self.history = MessageHistory()  # Every message of the conversation, a MessageLog once messaging starts
+        self.first_row = 0  # Index of the message shown in the top row
+        self.shown_rows = 0  # Number of messages that fit in the view, as rows are as tall as their wrapped text
+        self.follow = True  # Keep the newest message in view, until the user scrolls up
+        self.message_rows = [  # Labels showing the visible messages, reused as the view scrolls
+            Label(self.message_canvas, font="Rockwell 16", bg=COLORS["accent2"], wraplength=WRAP_LENGTH) for _ in range(MESSAGE_ROWS)
+        ]
+        self.message_scrollbar = Scrollbar(self.message_canvas, orient=VERTICAL, command=self.scroll_messages)
+        self.message_scrollbar.place(relx=1, rely=0, relheight=1, anchor=NE)
+        for widget in [self.message_canvas, *self.message_rows]:
+            widget.bind("<MouseWheel>", lambda event: self.scroll_messages("scroll", -event.delta // 120, "units"))
+            widget.bind("<Button-4>", lambda event: self.scroll_messages("scroll", -1, "units"))  # Wheel on X11
+            widget.bind("<Button-5>", lambda event: self.scroll_messages("scroll", 1, "units"))
+        self.events = queue.SimpleQueue()  # Updates from other threads, handled on the main thread by handle_events()
 
     @property
     def state(self):
@@ -48,7 +73,7 @@ class ControlPanel(Tk):
     @state.setter
     def state(self, value: str | int):
         if isinstance(value, int):
-            value = UI_STATES[value]
+            value = STATES[value]
         self._state = value
         match value:
             case "select_user":
@@ -66,6 +91,48 @@ class ControlPanel(Tk):
             case _:
                 raise ValueError("Invalid state")
 
+    def post(self, method: str, *args):
+        """
+        Queue a call of one of the control panel's methods, to be made on the main thread
+        Tk widgets may only be used from the main thread, so other threads must update the control panel through this
+        """
+        self.events.put((method, args))
+
+    def handle_events(self):
+        """
+        Make the queued calls, merging received messages into a single update
+        """
+        try:
+            events = []
+            try:
+                while len(events) < MAX_EVENTS:
+                    events.append(self.events.get_nowait())
+            except queue.Empty:
+                pass
+
+            messages = []  # Received messages, waiting to be shown together
+            for method, args in events:
+                if method == "receive_message":
+                    messages.extend(args[0] if isinstance(args[0], list) else [args[0]])
+                    continue
+                if messages:  # Show the messages before any other update, to keep the order
+                    self.receive_message(messages)
+                    messages = []
+                try:
+                    getattr(self, method)(*args)
+                except Exception as e:
+                    print(f"Failed to handle {method}: {e}")
+            if messages:
+                self.receive_message(messages)
+        finally:
+            self.after(EVENT_INTERVAL, self.handle_events)
+
+    def set_state(self, value: str | int):
+        """
+        Set the state, as a method so it can be queued with post()
+        """
+        self.state = value
+
     def set_selected_user(self, user: str):
         """
         Set the selected user, and start receiving requests
@@ -75,36 +142,47 @@ class ControlPanel(Tk):
         self.DH.start()
         self.state = 1
 
-    def submit_shared(self, p: int, g: int):
+    def submit_shared(self, kex: str, p=-1, g=-1):
         """
         Submit the shared values and send them to the other user
+        :param kex: Key agreement, p and g are only used by mod-p
         """
+        self.DH.kex = kex
         self.DH.p = p
         self.DH.g = g
-        connection = self.DH.send_request("shared")
-        if connection:
-            self.lost_connection_label.place_forget()
-        else:
-            self.lost_connection_label.place(relx=0.5, rely=0.95, anchor=CENTER)
+        self.DH.send_request_async("shared", callback=lambda connection: self.post("show_connection", connection, 0.95))
         self.state = 2
 
-    def submit_secret(self, secret: int):
+    def submit_secret(self, secret: int = None):
         """
         Submit the secret value
+        :param secret: The secret value, or None for a random key pair from the pool of precomputed pairs
         """
-        self.DH.secret = secret
-        self.DH.calculate_public_key()
-        connection = self.DH.send_request("public")
-        if connection:
-            self.lost_connection_label.place_forget()
-        else:
-            self.lost_connection_label.place(relx=0.5, rely=0.9, anchor=CENTER)
+        # The key calculations run on a sending thread so the window stays responsive, and the public key is sent once they are done
+        self.DH.queue_send(self.DH.pick_secret, secret, callback=lambda _: self.post("secret_picked"))
+        self.DH.send_request_async("public", callback=lambda connection: self.post("public_sent", connection))
+
+    def secret_picked(self):
+        """
+        Wait for the remote public key, or show the keys if it already arrived
+        """
+        self.state = 3 if self.DH.remote_public == -1 else 4
 
-        if self.DH.remote_public == -1:
-            self.state = 3
+    def resume(self):
+        """
+        Continue the last conversation with the remote user with a new key, instead of a full exchange
+        """
+        self.DH.queue_send(self.DH.resume, callback=lambda resumed: self.post("resumed", resumed))
+
+    def resumed(self, resumed: bool):
+        """
+        Go straight to messaging if the conversation was resumed
+        """
+        if resumed:
+            self.lost_connection_label.place_forget()
+            self.state = "messaging"
         else:
-            self.DH.calculate_shared_secret()
-            self.state = 4
+            self.show_connection(False, 0.95)
 
     def send_message(self, message: str, field: Entry):
         """
@@ -113,18 +191,28 @@ class ControlPanel(Tk):
         if message == "":
             return
         if self.state == "messaging":
-            connection = self.DH.send_message(message)
-            if connection:
-                self.lost_connection_label.place_forget()
-            else:
-                self.lost_connection_label.place(relx=0.5, rely=0.9, anchor=CENTER)
-        self.message_list.append(
-            Label(self.message_canvas, text=message, fg=COLORS["text"], font="Rockwell 16", bg=COLORS["accent2"], wraplength=500))
-        self.message_list[-1].pack(anchor=NE, pady=5, padx=5)
-        if len(self.message_list) > 9:
-            self.message_list.pop(0).destroy()  # Remove the oldest message
+            self.DH.queue_message(message, callback=lambda connection: self.post("show_connection", connection, 0.9))  # Sent with messages typed right after
+        self.history.append(SENT, message)
+        self.render_messages()
         field.delete(0, END)
 
+    def show_connection(self, connection: bool, rely: float):
+        """
+        Show or hide the lost connection label, after a send has finished
+        """
+        if connection:
+            self.lost_connection_label.place_forget()
+        else:
+            self.lost_connection_label.place(relx=0.5, rely=rely, anchor=CENTER)
+
+    def public_sent(self, connection: bool):
+        """
+        Update after our public key was sent, the response may have contained the remote public key
+        """
+        self.show_connection(connection, 0.9)
+        if self.state == "awaiting_public" and self.DH.remote_public != -1:
+            self.state = 4
+
     def receive_shared(self, p: int, g: int):
         """
         Set the shared values
@@ -134,6 +222,14 @@ class ControlPanel(Tk):
         self.DH.g = g
         self.state = 2
 
+    def shared_values(self) -> tuple:
+        """
+        :return: Label and value of both shared value rows, the prime and generator for mod-p, or the curve for an elliptic curve
+        """
+        if self.DH.kex == "modp":
+            return "Shared prime (p)", self.DH.p, "Shared generator (g)", self.DH.g
+        return "Key agreement", self.DH.kex, "Parameters", "Fixed by the curve"
+
     def receive_public(self, remote_public: int):
         """
         Get the public values
@@ -162,22 +258,105 @@ class ControlPanel(Tk):
         elif self.state == "awaiting_public":
             self.state = 4
 
-    def receive_message(self, message: str):
+    def receive_message(self, message: str | bool | list):
         """
-        Receive a message from the other client
+        Receive a message, or a list of messages sent as a batch, from the other client
         """
-        print(f"Received message: {message}")  # Print the message
+        messages = message if isinstance(message, list) else [message]
+        for message in messages:
+            print(f"Received message: {message}")  # Print the message
         if self.state != "messaging":
             return
-        if message is False:  # If we receive a message that could not be decrypted
-            self.message_list.append(
-                Label(self.message_canvas, text="*Invalid Message*", fg=COLORS["error"], font="Rockwell 16", bg=COLORS["accent2"], wraplength=500))
+        for message in messages:
+            if message is False:  # If we receive a message that could not be decrypted
+                self.history.append(INVALID, "")
+            else:
+                self.history.append(RECEIVED, message)
+        self.render_messages()  # A single update, however many messages arrived
+
+    def render_messages(self):
+        """
+        Show the visible part of the history in the reused row labels, each as tall as its wrapped text
+        While following, the newest message is at the bottom and older messages fill the space above it
+        """
+        total = len(self.history)
+        height = int(self.message_canvas.cget("height"))
+        for label in self.message_rows:
+            label.place_forget()
+        self.shown_rows = 0
+        if self.follow:
+            y = height - ROW_PADDING
+            for label in self.message_rows:
+                index = total - 1 - self.shown_rows
+                if index < 0:
+                    break
+                kind = self.fill_row(label, index)
+                if self.shown_rows and label.winfo_reqheight() > y:  # The newest message is always shown, older ones only if they fit
+                    break
+                label.place(x=480 if kind == SENT else 5, y=y, anchor=SE if kind == SENT else SW)
+                y -= label.winfo_reqheight() + ROW_PADDING
+                self.shown_rows += 1
+            self.first_row = total - self.shown_rows
+        else:
+            y = ROW_PADDING
+            for label in self.message_rows:
+                index = self.first_row + self.shown_rows
+                if index >= total or y >= height:
+                    break
+                kind = self.fill_row(label, index)
+                label.place(x=480 if kind == SENT else 5, y=y, anchor=NE if kind == SENT else NW)  # Sent messages to the right
+                y += label.winfo_reqheight() + ROW_PADDING
+                self.shown_rows += 1
+        if total > self.shown_rows:
+            self.message_scrollbar.set(self.first_row / total, (self.first_row + self.shown_rows) / total)
+        else:
+            self.message_scrollbar.set(0, 1)
+
+    def fill_row(self, label: Label, index: int) -> int:
+        """
+        Show a message of the history in a row label
+        :return: The kind of the message
+        """
+        kind, text = self.history[index]
+        if kind == INVALID:
+            label.config(text="*Invalid Message*", fg=COLORS["error"], justify=LEFT)
+        else:
+            label.config(text=text, fg=COLORS["text"], justify=RIGHT if kind == SENT else LEFT)
+        return kind
+
+    def scroll_messages(self, action: str, amount, unit=None):
+        """
+        Scroll the message view, called by the scrollbar and the mouse wheel
+        """
+        if action == "moveto":
+            self.first_row = int(float(amount) * len(self.history))
+        elif unit == "pages":
+            self.first_row += int(amount) * max(1, self.shown_rows)
         else:
-            self.message_list.append(
-                Label(self.message_canvas, text=message, fg=COLORS["text"], font="Rockwell 16", bg=COLORS["accent2"], wraplength=500))
-        self.message_list[-1].pack(anchor=NW, pady=5, padx=5)
-        if len(self.message_list) > 8:
-            self.message_list.pop(0).destroy()  # Remove the oldest message
+            self.first_row += int(amount)
+        self.first_row = min(max(self.first_row, 0), max(0, len(self.history) - 1))
+        self.follow = False
+        self.render_messages()
+        if self.first_row + self.shown_rows >= len(self.history):  # Follow new messages again once scrolled to the bottom
+            self.follow = True
+            self.render_messages()
+
+    def clear_history(self):
+        """
+        Stop showing the messages, when starting a new conversation. A logged history stays on disk
+        """
+        if isinstance(self.history, MessageLog):
+            self.history.close()
+        self.history = MessageHistory()
+        self.first_row = 0
+        self.follow = True
+        self.render_messages()
+
+    def receive_file(self, path: str):
+        """
+        Show that a file was received from the other client
+        """
+        self.receive_message(f"*Received file {os.path.basename(path)}*")
 
     def start(self):
         """
@@ -187,6 +366,7 @@ class ControlPanel(Tk):
         self.setup_main_window()
         print("Running program...")
         self.select_user()
+        self.after(EVENT_INTERVAL, self.handle_events)
         self.mainloop()
 
     def setup_main_window(self) -> None:
@@ -314,6 +494,26 @@ class ControlPanel(Tk):
             command=lambda: (g_entry.delete(0, END), g_entry.insert(0, DEFAULT_VALUES["g"]))  # Clear the entry and insert the default value
         )
 
+        group = StringVar(self, value="Standard group")
+        group_menu = OptionMenu(
+            self,
+            group,
+            *STANDARD_GROUPS,
+            command=lambda name: (  # Clear the entries and insert the values of the selected group
+                p_entry.delete(0, END), p_entry.insert(0, STANDARD_GROUPS[name][1]),
+                g_entry.delete(0, END), g_entry.insert(0, STANDARD_GROUPS[name][0])
+            )
+        )
+        group_menu.config(bg=COLORS["accent"], fg=COLORS["text"], font="Rockwell 14", borderwidth=0, highlightthickness=0)
+
+        def use_kex(name: str):  # Curves have fixed parameters, so p and g are only entered for mod-p
+            for widget in (p_entry, p_default, g_entry, g_default, group_menu):
+                widget.config(state=NORMAL if name == "modp" else DISABLED)
+
+        kex = StringVar(self, value=self.DH.kex)  # Key agreement to propose, starts as the one given on the command line
+        kex_menu = OptionMenu(self, kex, *KEX, command=use_kex)
+        kex_menu.config(bg=COLORS["accent"], fg=COLORS["text"], font="Rockwell 14", borderwidth=0, highlightthickness=0)
+
         submit_button = Button(
             self,
             text="Send",
@@ -322,7 +522,7 @@ class ControlPanel(Tk):
             bg=COLORS["accent"],
             fg=COLORS["text"], font="Rockwell 25",
             borderwidth=0,
-            command=lambda: self.submit_shared(int(p_entry.get()), int(g_entry.get()))
+            command=lambda: self.submit_shared(kex.get()) if kex.get() != "modp" else self.submit_shared(kex.get(), int(p_entry.get()), int(g_entry.get()))
         )
 
         p_label.place(relx=0.05, rely=0.4, anchor=W)
@@ -331,8 +531,26 @@ class ControlPanel(Tk):
         g_label.place(relx=0.05, rely=0.6, anchor=W)
         g_entry.place(relx=0.55, rely=0.6, anchor=CENTER)
         g_default.place(relx=0.88, rely=0.6, anchor=CENTER)
+        group_menu.place(relx=0.88, rely=0.27, anchor=CENTER)
+        kex_menu.place(relx=0.12, rely=0.27, anchor=CENTER)
         submit_button.place(relx=0.5, rely=0.8, anchor=CENTER)
-        self.temp_items.extend([sub_title, p_label, p_entry, p_default, g_label, g_entry, g_default, submit_button])
+        self.temp_items.extend([sub_title, p_label, p_entry, p_default, g_label, g_entry, g_default, group_menu, kex_menu, submit_button])
+        use_kex(kex.get())
+
+        if self.DH.tickets.for_peer(self.DH.url) is not None:  # An earlier conversation with the remote user can be resumed
+            resume_button = Button(
+                self,
+                text="Resume",
+                width=10,
+                height=1,
+                bg=COLORS["accent"],
+                fg=COLORS["text"],
+                font="Rockwell 14",
+                borderwidth=0,
+                command=self.resume
+            )
+            resume_button.place(relx=0.88, rely=0.8, anchor=CENTER)
+            self.temp_items.append(resume_button)
 
     def pick_secret(self):
         """
@@ -344,10 +562,11 @@ class ControlPanel(Tk):
         sub_title.place(relx=0.5, rely=0.17, anchor=CENTER)
         self.value_canvas = Canvas(self, width=750, height=250, bg=COLORS["background"], highlightthickness=0)
         self.value_canvas.place(relx=0.04, rely=0.52, anchor=W)
-        p_label = Label(self.value_canvas, text=f"Shared prime (p)", fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
-        p_value = Label(self.value_canvas, text=self.DH.p, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
-        g_label = Label(self.value_canvas, text=f"Shared generator (g)", fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
-        g_value = Label(self.value_canvas, text=self.DH.g, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        p_text, p, g_text, g = self.shared_values()
+        p_label = Label(self.value_canvas, text=p_text, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        p_value = Label(self.value_canvas, text=p, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        g_label = Label(self.value_canvas, text=g_text, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        g_value = Label(self.value_canvas, text=g, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
         x_label = Label(self.value_canvas, text=f"Private value ({self.DH.name[0].lower()})", fg=COLORS["text"], font="Rockwell 20",
                         bg=COLORS["background"])
         x_entry = Entry(
@@ -372,6 +591,17 @@ class ControlPanel(Tk):
             borderwidth=0,
             command=lambda: self.submit_secret(int(x_entry.get()))
         )
+        random_button = Button(
+            self,
+            text="Random",
+            width=10,
+            height=1,
+            bg=COLORS["accent"],
+            fg=COLORS["text"],
+            font="Rockwell 14",
+            borderwidth=0,
+            command=lambda: self.submit_secret()  # Use a precomputed key pair, so the public key goes out without waiting
+        )
         p_label.place(relx=0, rely=0.1, anchor=W)
         p_value.place(relx=0.4, rely=0.1, anchor=W)
         g_label.place(relx=0, rely=0.3, anchor=W)
@@ -382,7 +612,8 @@ class ControlPanel(Tk):
         self.value_canvas.create_line(0, 95, 900, 95, fill=COLORS["accent"], width=2)
         self.value_canvas.create_line(0, 150, 900, 150, fill=COLORS["accent"], width=2)
         submit_button.place(relx=0.5, rely=0.8, anchor=CENTER)
-        self.temp_items.extend([sub_title, p_label, g_label, x_label, x_entry, self.value_canvas, submit_button])
+        random_button.place(relx=0.88, rely=0.8, anchor=CENTER)
+        self.temp_items.extend([sub_title, p_label, g_label, x_label, x_entry, self.value_canvas, submit_button, random_button])
 
     def awaiting_public(self):
         """
@@ -394,10 +625,11 @@ class ControlPanel(Tk):
         sub_title.place(relx=0.5, rely=0.17, anchor=CENTER)
         self.value_canvas = Canvas(self, width=750, height=250, bg=COLORS["background"], highlightthickness=0)
         self.value_canvas.place(relx=0.04, rely=0.52, anchor=W)
-        p_label = Label(self.value_canvas, text=f"Shared prime (p)", fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
-        p_value = Label(self.value_canvas, text=self.DH.p, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
-        g_label = Label(self.value_canvas, text=f"Shared generator (g)", fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
-        g_value = Label(self.value_canvas, text=self.DH.g, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        p_text, p, g_text, g = self.shared_values()
+        p_label = Label(self.value_canvas, text=p_text, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        p_value = Label(self.value_canvas, text=p, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        g_label = Label(self.value_canvas, text=g_text, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        g_value = Label(self.value_canvas, text=g, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
         x_label = Label(self.value_canvas, text=f"Private key ({self.DH.name[0].lower()})", fg=COLORS["text"], font="Rockwell 20",
                         bg=COLORS["background"])
         x_value = Label(self.value_canvas, text=self.DH.secret, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
@@ -427,10 +659,11 @@ class ControlPanel(Tk):
         sub_title.place(relx=0.5, rely=0.17, anchor=CENTER)
         self.value_canvas = Canvas(self, width=750, height=300, bg=COLORS["background"], highlightthickness=0)
         self.value_canvas.place(relx=0.04, rely=0.21, anchor=NW)
-        p_label = Label(self.value_canvas, text=f"Shared prime (p)", fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
-        p_value = Label(self.value_canvas, text=self.DH.p, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
-        g_label = Label(self.value_canvas, text=f"Shared generator (g)", fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
-        g_value = Label(self.value_canvas, text=self.DH.g, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        p_text, p, g_text, g = self.shared_values()
+        p_label = Label(self.value_canvas, text=p_text, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        p_value = Label(self.value_canvas, text=p, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        g_label = Label(self.value_canvas, text=g_text, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
+        g_value = Label(self.value_canvas, text=g, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
         X_label = Label(self.value_canvas, text=f"Public key ({self.DH.name[0].upper()})", fg=COLORS["text"], font="Rockwell 20",
                         bg=COLORS["background"])
         X_value = Label(self.value_canvas, text=self.DH.public, fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
@@ -451,7 +684,8 @@ class ControlPanel(Tk):
             fg=COLORS["text"],
             font="Rockwell 14",
             borderwidth=0,
-            command=lambda: (setattr(self, "state", "messaging"), self.DH.send_request("start_chat"))
+            command=lambda: (setattr(self, "state", "messaging"),  # Messages then go over a channel, if the remote user accepts one
+                             self.DH.send_request_async("start_chat", callback=lambda started: started and self.DH.open_channel()))
         )
         p_label.place(relx=0, rely=0, anchor=NW)
         p_value.place(relx=0.4, rely=0, anchor=NW)
@@ -481,6 +715,13 @@ class ControlPanel(Tk):
         A place to message the other client, using AES with the shared secret as key
         """
         self.clear_temp_items()
+        if not isinstance(self.history, MessageLog):
+            try:
+                self.history = self.DH.open_message_log()  # Brings back the history when a conversation is resumed
+            except (OSError, ValueError) as e:
+                print(f"Could not open the message log: {e}")
+            self.follow = True
+            self.render_messages()
         sub_title = Label(self, text="Messaging", fg=COLORS["text"], font="Rockwell 20", bg=COLORS["background"])
         secret_label = Label(self, text=f"Shared key (K) {self.DH.shared_secret}", fg=COLORS["text"], font="Rockwell 16", bg=COLORS["background"],
                              wraplength=150)
@@ -1,37 +1,122 @@
-from ControlPanel import ControlPanel
-from encryption import Encryption
+from batching import MessageBatcher, MessageOrder
+import channel
+from compute import ComputeExecutor, INLINE
+from encryption import Encryption, MODES
+from keyagreement import KEX, KeyAgreement
+from keypool import KeyPool
+from messagelog import MessageLog, log_key
+import metrics
+from server import KeepAliveHandler, make_server
+import protocol
+from sessions import SessionTable
+import streaming
+from tickets import TicketCache
+import tickets
+from tracing import TRACER, DEBUG, INFO
+import tracing
+import wire
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import argparse
 import json
+import os
+from requests.adapters import HTTPAdapter
 import requests
+import secrets
 import sys
 import threading
+import time
+import urllib.parse
+import urllib3
 
 
-class DHHTTPHandler(BaseHTTPRequestHandler):
+class DHHTTPHandler(KeepAliveHandler):  # Keeps connections open between requests, without holding a worker while they are idle
+    timeout = 5  # Seconds to wait for the rest of a request, so a peer that stops sending mid-request frees its worker
+    disable_nagle_algorithm = True  # Headers and body are written separately, which would stall kept alive connections on delayed ACKs
+
     def __init__(self, request, client_address, server):
         super().__init__(request, client_address, server)
 
-    def _set_response(self):
+    def _set_response(self, content_length: int, content_type="application/json"):
         self.send_response(200)
-        self.send_header("Content-type", "application/json")
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(content_length))  # Required for the client to find the end of a kept alive response
         self.end_headers()
 
     def do_POST(self) -> None:
         """
         Handles POST requests
         """
+        content_type = self.headers.get("Content-Type", "application/json")
+        if content_type == streaming.CONTENT_TYPE:  # Encrypted file, decrypted to disk while it is read
+            self.handle_stream()
+            return
+
         content_length = int(self.headers["Content-Length"])  # Gets the size of data
         post_data = self.rfile.read(content_length)  # Gets the data itself
-        post_data = json.loads(post_data.decode("utf-8"))  # Parse as json
-        response = DH.receive_request(post_data)  # Pass data to DH and get response
+        if content_type == wire.CONTENT_TYPE:
+            post_data = wire.decode(post_data)  # Parse as a binary frame, bytes values stay views of the read buffer
+        else:
+            content_type = "application/json"
+            post_data = json.loads(post_data.decode("utf-8"))  # Parse as json
+        response = self.server.dh.receive_request(post_data)  # Pass data to the server's DH and get response
+
+        if content_type == wire.CONTENT_TYPE:  # Answer in the format of the request
+            response = wire.encode(response)
+        else:
+            response = json.dumps(response, default=wire.to_hex).encode("utf-8")
+        self._set_response(len(response), content_type)
+        self.wfile.write(response)  # Send response
+
+    def log_request(self, code="-", size="-") -> None:
+        """
+        Record each request in the trace instead of writing it to stderr, errors are still logged
+        """
+        TRACER.event("http.request", DEBUG, request=self.requestline, code=str(code))
 
-        self._set_response()
-        self.wfile.write(json.dumps(response).encode("utf-8"))  # Send response
+    def do_GET(self) -> None:
+        """
+        Handles GET requests, serving the metrics for scraping and upgrading connections to channels
+        """
+        path = self.path.split("?")[0]
+        if path == channel.PATH and self.headers.get("Upgrade", "").lower() == channel.PROTOCOL:
+            self.server.dh.accept_channel(self)
+            return
+        if path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.REGISTRY.render().encode("utf-8")
+        self._set_response(len(body), metrics.CONTENT_TYPE)
+        self.wfile.write(body)
+
+    def handle_stream(self) -> None:
+        """
+        Handles a streamed file, sent with chunked transfer encoding or a Content-Length
+        """
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            reader = streaming.ChunkedReader(self.rfile)
+        else:
+            reader = streaming.LengthReader(self.rfile, int(self.headers.get("Content-Length", 0)))
+        start = time.perf_counter()
+        with TRACER.span("receive.stream", session=self.headers.get("X-DH-Session")) as span:
+            response = self.server.dh.receive_stream(reader.read, self.headers)
+            span.set("success", response["success"])
+        metrics.REQUESTS.inc("stream")
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, "stream")
+        if not response["success"]:
+            metrics.REQUEST_ERRORS.inc("stream")
+            self.close_connection = True  # The rest of the body may be unread, so the connection can't be reused
+
+        response = json.dumps(response).encode("utf-8")
+        self._set_response(len(response))
+        self.wfile.write(response)  # Send response
 
 
 class DiffieHellman:
-    def __init__(self, port=8080, name="", g=-1, p=-1, secret=-1, public=-1, remote_public=-1, shared_secret=-1, remote_ip="", remote_port=8080):
+    def __init__(self, port=8080, name="", g=-1, p=-1, secret=-1, public=-1, remote_public=-1, shared_secret=-1, remote_ip="", remote_port=8080,
+                 workers=8, pool_size=4, wire_format="json", batch_window=0.05, batch_size=32, session_id=None, max_sessions=10000,
+                 session_timeout=300.0, cipher_mode="eax", timeout=5.0, retries=2, backoff=0.25, kex="modp",
+                 keypool_size=8, tickets: TicketCache = None, compute_workers=0, max_channels=64, max_queued=256):
         self.port = port  # Port to run the server on
         self._name = name  # Name of the user, Alice or Bob
         self.g = g  # Shared generator g
@@ -39,10 +124,54 @@ class DiffieHellman:
         self.secret = secret  # Own secret key
         self.public = public  # Own public key
         self.remote_public = remote_public  # Remote public key
+        self._cipher = None  # Encryption for the shared key, built on first use
+        self.message_order = None  # Puts received messages back in the order they were sent, renewed with every shared secret
         self.shared_secret = shared_secret  # Shared key K
+        self.cipher_mode = cipher_mode  # AEAD mode for messages, sent with the shared parameters
+        self.kex = kex  # Key agreement, 'modp' with g and p or an elliptic curve, sent with the shared parameters
         self.remote_ip = remote_ip  # IP of the remote user
         self.remote_port = remote_port  # Port of the remote user
+        self.workers = workers  # Number of threads handling requests, 1 handles one request at a time
+        self.pool_size = pool_size  # Number of kept alive connections to the remote user
+        self.wire_format = wire_format  # Format of sent requests, 'json' or 'binary'
+        self.batch_window = batch_window  # Seconds that queued messages wait for more messages to batch with
+        self.batch_size = batch_size  # Largest number of queued messages sent in one request
+        self.batcher = None  # Sends queued messages in batches, gets initialized in queue_message()
+        self.session_id = session_id  # Sent with every request if set, so the remote server keeps our exchange apart from others
+        self.compute_workers = compute_workers  # Processes for key calculations and large encryptions, 0 runs them on the request threads
+        self.compute = ComputeExecutor(compute_workers) if compute_workers else INLINE
+        self.keypool = KeyPool(keypool_size, workers=max(1, compute_workers), compute=self.compute)  # Key pairs calculated ahead of the handshakes that use them
+        self.tickets = tickets if tickets is not None else TicketCache()  # Resumption tickets of completed exchanges, kept across resets
+        self.sessions = SessionTable(max_sessions, session_timeout, keypool=self.keypool, tickets=self.tickets,
+                                     compute=self.compute)  # Exchanges with remote users that send a session ID
+        self.ui = None  # Control panel updated through its event queue by received requests, None when running headless
+        self.on_message = None  # Called with a list of received messages, if given
+        self.on_file = None  # Called with the path of each received file, if given
+        self.last_error = None  # Error the remote user gave for the last failed send_request, None if it could not be reached
+        self.channel = None  # Open channel our messages are sent over instead of requests, gets initialized in open_channel()
+        self.channels = set()  # Every open channel, opened by us or by remote users, closed in stop()
+        self.max_channels = max_channels  # Largest number of open channels, as each is read on its own thread
+        self.download_dir = "downloads"  # Directory received files are written to
+        self.log_dir = "logs"  # Directory of the encrypted message logs
+        self.log_key = None  # Key of the conversation's message log, from the first exchange with the remote user, kept by resumption
+
+        self.timeout = timeout  # Seconds to wait for the remote user to connect and to answer
+        self.retries = retries  # Number of times a request is sent again, after failing to connect or timing out
+        self.backoff = backoff  # Seconds before the first retry, doubled for every further retry
+        self.max_queued = max_queued  # Largest number of asynchronous sends waiting or in flight, later sends fail right away
+        # Runs asynchronous requests and messages, one thread per kept alive connection. Requests wait for every earlier send, so the
+        # handshake steps and the start of the chat reach the remote user in order, while the messages between them are sent concurrently
+        self.sender = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="dh-send")
+        self.send_slots = threading.BoundedSemaphore(max_queued)
+        self.send_lock = threading.Lock()  # Guards the order of queued sends
+        self.barrier = None  # Future of the last queued request, later sends start after it
+        self.since_barrier = []  # Futures of the messages queued since the last request, the next request starts after them
 
+        self.session = requests.Session()  # Reuses connections to the remote user, instead of connecting for every request
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+
+        self.lock = threading.RLock()  # Guards the session state, as requests can be handled concurrently
         self.httpd = None  # HTTP server, gets initialized in start()
         self.server_thread = threading.Thread(target=self.run_server)  # Thread for the HTTP server
 
@@ -64,6 +193,66 @@ class DiffieHellman:
             self.port = 8001
             self.remote_port = 8000
 
+    @property
+    def shared_secret(self) -> int:
+        return self._shared_secret
+
+    @shared_secret.setter
+    def shared_secret(self, value: int) -> None:
+        """
+        Update the shared secret, and drop the encryption built from the old one
+        Sequence numbers of sent and received messages start over with the new key
+        """
+        self._shared_secret = value
+        self.drop_cipher()
+        self.send_seq = 0  # Sequence number of the next sent message
+        if self.message_order is not None:
+            self.message_order.close()
+        self.message_order = MessageOrder(self.deliver)
+
+    @property
+    def cipher_mode(self) -> str:
+        return self._cipher_mode
+
+    @cipher_mode.setter
+    def cipher_mode(self, value: str) -> None:
+        """
+        Update the AEAD mode, and drop the encryption built for the old one
+        """
+        if value not in MODES:
+            raise ValueError(f"Unsupported cipher mode {value}")
+        self._cipher_mode = value
+        self.drop_cipher()
+
+    def drop_cipher(self) -> None:
+        """
+        Drop the encryption of the old key or mode, and close the channels still encrypted with it
+        """
+        old, self._cipher = self._cipher, None
+        if old is None:  # Never built, so no channel uses it
+            return
+        with self.lock:
+            channels = [channel_ for channel_ in self.channels if channel_.cipher is old]
+        for channel_ in channels:
+            channel_.close()
+
+    @property
+    def cipher(self) -> Encryption:
+        """
+        :return: Encryption for the current shared secret and mode, reused until either changes
+        """
+        with self.lock:
+            if self._cipher is None:
+                self._cipher = Encryption(self.shared_secret, self.cipher_mode)
+            return self._cipher
+
+    @property
+    def key_agreement(self) -> KeyAgreement:
+        """
+        :return: Backend for the negotiated key agreement and, for mod-p, the shared parameters
+        """
+        return self.keypool.agreement(self.kex, self.g, self.p)
+
     @property
     def remote_name(self) -> str:
         """
@@ -80,16 +269,45 @@ class DiffieHellman:
         Calculates the public key, based on the secret key and the shared parameters
         :return: The public key
         """
-        self.public = pow(self.g, self.secret, self.p)
-        return self.public
+        with self.lock, TRACER.span("kex.public", kex=self.kex), metrics.KEX_SECONDS.time("public", self.kex):
+            self.public = self.compute.run(self.key_agreement.public_key, self.secret)
+            return self.public
+
+    def pick_secret(self, secret: int = None) -> int:
+        """
+        Use a secret key picked by the user, or a random key pair if none is given, and calculate the shared secret if the remote public
+        key is already known
+        :return: The public key
+        """
+        with self.lock:
+            if secret is None:
+                self.generate_keypair()
+            else:
+                self.secret = secret
+                self.calculate_public_key()
+            if self.remote_public != -1:
+                self.calculate_shared_secret()
+            return self.public
+
+    def generate_keypair(self) -> int:
+        """
+        Use a random key pair, taken from the pool of precomputed pairs so the handshake doesn't wait on the calculation
+        :return: The public key
+        """
+        with self.lock, TRACER.span("kex.keypair", kex=self.kex):
+            self.secret, self.public = self.keypool.take(self.key_agreement)
+            return self.public
 
     def calculate_shared_secret(self) -> int:
         """
         Calculates the shared secret, based on the remote public key and the shared parameters
         :return: The shared secret.
         """
-        self.shared_secret = pow(self.remote_public, self.secret, self.p)
-        return self.shared_secret
+        with self.lock, TRACER.span("kex.shared", kex=self.kex), metrics.KEX_SECONDS.time("shared", self.kex):
+            self.shared_secret = self.compute.run(self.key_agreement.shared_secret, self.secret, self.remote_public)
+            self.log_key = log_key(self.shared_secret)  # A full exchange starts a new conversation
+            self.tickets.issue(self.shared_secret, self.cipher_mode, self.url, self.log_key)  # Both sides derive the same ticket
+            return self.shared_secret
 
     def send_request(self, request_type: str) -> bool:
         """
@@ -97,14 +315,21 @@ class DiffieHellman:
         :param request_type: 'shared' for the shared parameters, 'public' for the public key
         :return:
         """
-        url = f"http://{self.remote_ip}:{self.remote_port}/"  # URL to send the request to
         data = {"name": self.name}  # Always send the name of the user, so we don't get two users with the same name
 
         match request_type:
-            case "shared":  # Send the shared parameters
-                data["type"] = "shared"
-                data["g"] = self.g
-                data["p"] = self.p
+            case "shared" | "handshake":  # Send the shared parameters
+                self.keypool.choose(self.key_agreement)  # We picked the group, so it is trusted for pooling
+                data["type"] = request_type
+                data["kex"] = self.kex
+                if self.kex == "modp":  # Curves have fixed parameters
+                    data["g"] = self.g
+                    data["p"] = self.p
+                data["mode"] = self.cipher_mode  # The remote user encrypts with the same mode
+                if request_type == "handshake":  # Our public key goes with the parameters, the remote user answers with theirs
+                    data["public"] = self.public
+                else:
+                    self.keypool.prepare(self.key_agreement)  # Fill the pool while the user picks a secret
             case "public":  # Send the public key
                 data["type"] = "public"
                 data["public"] = self.public
@@ -114,31 +339,401 @@ class DiffieHellman:
             case _:
                 return False
 
-        print("Sending request: ", data)
-        try:
-            r = requests.post(url, json=data).json()  # Send the data
-        except requests.exceptions.ConnectionError:  # If the connection failed
-            print("Connection error")
+        with TRACER.span("send." + data["type"], session=self.session_id) as span:  # Only the type is traced, never the values
+            r = self.post(data)
+            self.last_error = None
+            if r is None:
+                span.set("success", False)
+                return False
+            if not r["success"]:
+                self.last_error = r.get("error", "")
+            if request_type in ("shared", "handshake") and r["success"] and not self.accept_negotiated(r):
+                span.set("success", False)
+                return False
+            span.set("success", r["success"])
+            if request_type in ("public", "handshake") and r["success"] and "public" in r:  # The remote user already has a public key
+                with self.lock:
+                    self.remote_public = r["public"]
+                    self.calculate_shared_secret()
+            return r["success"]
+
+    def accept_negotiated(self, response: dict) -> bool:
+        """
+        Use the key agreement and AEAD mode the remote user answered with, which may differ from what we proposed
+        Remote users that don't negotiate answer without them, and use mod-p and EAX
+        :param response: The response to the shared parameters
+        :return: True if we can use them, False if the exchange has to be aborted
+        """
+        kex = response.get("kex", "modp")
+        mode = response.get("mode", "eax")
+        if kex != self.kex:  # Our parameters and public key are for the proposed key agreement
+            print(f"Remote user answered with key agreement {kex}, expected {self.kex}")
+            return False
+        if mode not in MODES:
+            print(f"Remote user answered with unsupported cipher mode {mode}")
             return False
-        return r["success"]
+        with self.lock:
+            self.cipher_mode = mode
+        return True
+
+    def resume(self) -> bool:
+        """
+        Agree on a new shared secret in one round trip, using the ticket of our last exchange with the remote user
+        :return: True if the exchange was resumed, False if there is no usable ticket and a full exchange is needed
+        """
+        ticket_id = self.tickets.for_peer(self.url)
+        ticket = self.tickets.take(ticket_id) if ticket_id is not None else None
+        if ticket is None:
+            return False
+        client_nonce = secrets.token_bytes(tickets.NONCE_SIZE)
+        data = {"name": self.name, "type": "resume", "ticket": ticket_id, "nonce": client_nonce,
+                "binder": tickets.binder(ticket.key, b"client", client_nonce)}
+        reopen = self.channel is not None  # The remote user closes the channel on the old key, ours is opened again with the new one
+        with TRACER.span("send.resume", session=self.session_id) as span:
+            r = self.post(data)
+            if r is None or not r["success"] or "nonce" not in r or "binder" not in r:
+                span.set("success", False)
+                return False
+            server_nonce = bytes(wire.as_bytes(r["nonce"]))
+            if not tickets.verify_binder(tickets.binder(ticket.key, b"server", client_nonce, server_nonce), wire.as_bytes(r["binder"])):
+                span.set("success", False)  # The server does not hold the ticket's key
+                return False
+            with self.lock:
+                self.cipher_mode = ticket.mode
+                self.shared_secret = tickets.resumed_secret(ticket.key, client_nonce, server_nonce)
+                self.log_key = ticket.log_key  # The same conversation, so the same log
+                self.tickets.issue(self.shared_secret, self.cipher_mode, self.url, self.log_key)  # The next ticket, as each is used once
+            span.set("success", True)
+        if reopen:
+            self.open_channel()
+        return True
 
-    def send_message(self, message) -> bool:
+    def send_message(self, message, seq: int = None) -> bool:
         """
         Send a message to the remote user
         :param message: The message to send
+        :param seq: Sequence number of the message, so the remote user can deliver concurrently sent messages in order
         :return: True if the message was sent successfully, False otherwise
         """
-        print(f"Sending message to {self.remote_name}")
-        url = f"http://{self.remote_ip}:{self.remote_port}/"  # URL to send the message to
-        enc = Encryption(self.shared_secret)  # Encryption object
-        enc_msg, tag, nonce = enc.encrypt(message)  # Encrypt the message
-        data = {"name": self.name, "type": "message", "message": enc_msg, "tag": tag, "nonce": nonce}  # Create the data to send
-        try:
-            r = requests.post(url, json=data).json()  # Send the data
-            return r["success"]  # Return whether the request was successful
-        except requests.exceptions.ConnectionError:  # If the connection failed
-            print("Connection error")
+        channel_ = self.channel
+        if channel_ is not None and channel_.open:  # Written as a frame, the connection reports failures instead of a response
+            with TRACER.span("send.channel", DEBUG, session=self.session_id) as span:
+                success = channel_.send(message, seq=seq)
+                span.set("success", success)
+            if success:
+                return True
+        with TRACER.span("send.message", DEBUG, session=self.session_id) as span:
+            enc_msg, tag, nonce = self.compute.run_cipher(self.cipher.encrypt_bytes, message.encode("utf-8"))  # Encrypt the message
+            data = {"name": self.name, "type": "message", "message": enc_msg, "tag": tag, "nonce": nonce}  # Create the data to send
+            if seq is not None:
+                data["seq"] = seq
+            span.set("size", len(enc_msg))
+            r = self.post(data)
+            success = r is not None and r["success"]
+            span.set("success", success)
+            return success  # Return whether the request was successful
+
+    def send_batch(self, messages: list[str], seq: int = None) -> bool:
+        """
+        Send several messages to the remote user in a single request, or as frames if a channel is open
+        :param messages: The messages to send, in order
+        :param seq: Sequence number of the first message, the others follow it
+        :return: True if the messages were sent successfully, False otherwise
+        """
+        channel_ = self.channel
+        sent = 0
+        if channel_ is not None and channel_.open:
+            with TRACER.span("send.channel", DEBUG, session=self.session_id, count=len(messages)) as span:
+                while sent < len(messages) and channel_.send(messages[sent], seq=None if seq is None else seq + sent):
+                    sent += 1
+                span.set("success", sent == len(messages))
+            if sent == len(messages):
+                return True
+            messages = messages[sent:]  # The channel closed, the rest go as a request
+        with TRACER.span("send.message_batch", DEBUG, session=self.session_id, count=len(messages)) as span:
+            batch = []
+            for message in messages:
+                enc_msg, tag, nonce = self.compute.run_cipher(self.cipher.encrypt_bytes, message.encode("utf-8"))  # Each message gets its own nonce and tag
+                batch.append({"message": enc_msg, "tag": tag, "nonce": nonce})
+            data = {"name": self.name, "type": "message_batch", "messages": batch}
+            if seq is not None:
+                data["seq"] = seq + sent
+            r = self.post(data)
+            success = r is not None and r["success"]
+            span.set("success", success)
+            return success
+
+    def queue_message(self, message: str, callback=None) -> None:
+        """
+        Queue a message, to be sent together with other messages queued within the batch window
+        Batches are sent after every request and batch given before them
+        :param message: The message to send
+        :param callback: Called with whether the message was sent, on a sending thread
+        """
+        with self.lock:
+            if self.batcher is None:
+                # The batching thread waits for room in the send queue, and callers of put wait once the batcher is full
+                self.batcher = MessageBatcher(lambda messages: self.queue_send(self.send_batch, messages, messages=len(messages), block=True),
+                                              window=self.batch_window, max_size=self.batch_size, max_pending=self.max_queued)
+            batcher = self.batcher
+        batcher.put(message, callback)
+
+    def flush(self, timeout=None) -> bool:
+        """
+        Wait until every queued message and request has been sent
+        :param timeout: Seconds to wait, None to wait until everything is sent
+        :return: True if everything was sent within the timeout
+        """
+        with self.lock:
+            batcher, self.batcher = self.batcher, None  # A new batcher is started for later messages
+        if batcher is not None:
+            batcher.close(timeout)
+        with self.send_lock:
+            pending = self.since_barrier + ([self.barrier] if self.barrier is not None else [])
+        return not wait(pending, timeout).not_done  # The last request runs after everything queued before it
+
+    def send_file(self, path: str, chunk_size=streaming.CHUNK_SIZE) -> bool:
+        """
+        Stream a file to the remote user, encrypting one chunk at a time
+        :param path: Path of the file to send
+        :param chunk_size: Plaintext bytes per chunk
+        :return: True if the file was received successfully, False otherwise
+        """
+        name = urllib.parse.quote(os.path.basename(path))
+        headers = {
+            "Content-Type": streaming.CONTENT_TYPE,
+            "X-DH-Name": self.name,
+            "X-DH-Filename": name,
+        }
+        if self.session_id is not None:
+            headers["X-DH-Session"] = self.session_id
+        metrics.SENDS.inc("stream")
+        with open(path, "rb") as f, TRACER.span("send.stream", session=self.session_id) as span, metrics.SEND_SECONDS.time("stream"):
+            try:
+                # A generator body is sent with chunked transfer encoding, so the file is never read whole
+                r = self.session.post(self.url, data=streaming.encrypt_stream(self.cipher, f, chunk_size, name.encode("ascii")), headers=headers,
+                                      timeout=self.timeout)
+                success = r.json()["success"]
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):  # If the connection failed
+                print("Connection error")
+                success = False
+            span.set("success", success)
+        if not success:
+            metrics.SEND_ERRORS.inc("stream")
+        return success
+
+    def open_channel(self) -> bool:
+        """
+        Open a channel to the remote user once the shared secret is established, later messages are sent over it as frames
+        :return: True if the channel is open, False if the remote user refused it or could not be reached
+        """
+        if self.shared_secret == -1:
             return False
+        headers = {"X-DH-Name": self.name}
+        if self.session_id is not None:
+            headers["X-DH-Session"] = self.session_id
+        session_id = self.session_id
+        with TRACER.span("channel.open", session=session_id) as span:
+            try:
+                channel_ = channel.connect(self.remote_ip, self.remote_port, self.cipher, headers, timeout=self.timeout,
+                                           on_message=self.receive_messages, on_close=self._channel_closed)
+            except (OSError, ValueError) as e:
+                span.set("error", str(e))
+                return False
+            with self.lock:
+                if channel_.open:  # Not already closed by the remote user
+                    self.channels.add(channel_)
+                old, self.channel = self.channel, channel_
+            if old is not None:
+                old.close()
+            span.set("success", True)
+            return True
+
+    def accept_channel(self, handler) -> None:
+        """
+        Answer a channel upgrade from the remote user, its frames are read on a thread of the channel so the worker is freed
+        :param handler: The request handler of the upgrade request
+        """
+        with self.lock:
+            full = len(self.channels) >= self.max_channels
+        if full:
+            handler.send_error(503, "Too many open channels")
+            return
+        session_id = handler.headers.get("X-DH-Session")
+        if session_id is not None:
+            session = self.sessions.get(session_id)
+            if session is None or session.shared_secret == -1:
+                handler.send_error(403, "Unknown session")
+                return
+            cipher = session.cipher
+            on_message = None
+            if self.sessions.on_message is not None:
+                on_message = lambda msgs, seq: self.sessions.receive_messages(session_id, session, msgs, seq)
+        else:
+            if handler.headers.get("X-DH-Name", "").lower() != self.remote_name.lower() or self.shared_secret == -1:
+                handler.send_error(403, f"Wrong name, expected {self.remote_name}")
+                return
+            cipher = self.cipher
+            on_message = self.receive_messages
+        channel_ = channel.accept(handler, cipher, on_message=on_message, on_close=self._channel_closed)
+        if channel_ is None:
+            return
+        TRACER.event("channel.accepted", INFO, session=session_id)
+        with self.lock:
+            if not channel_.open:  # Already closed by the remote user
+                return
+            self.channels.add(channel_)
+            if session_id is None and (self.channel is None or not self.channel.open):  # Answer over the same channel
+                self.channel = channel_
+
+    def _channel_closed(self, channel_: channel.Channel) -> None:
+        with self.lock:
+            self.channels.discard(channel_)
+            if self.channel is channel_:
+                self.channel = None  # Messages go back to requests
+
+    def receive_messages(self, msgs: list, seq: int = None) -> None:
+        """
+        Deliver received messages, in the order they were sent if they have a sequence number
+        """
+        if seq is None:
+            self.deliver(msgs)
+        else:
+            self.message_order.receive(seq, msgs)
+
+    def deliver(self, msgs: list) -> None:
+        """
+        Pass received messages to the control panel and the message callback
+        """
+        if self.ui is not None:
+            self.ui.post("receive_message", msgs if len(msgs) > 1 else msgs[0])  # Update the control panel
+        if self.on_message is not None:
+            self.on_message(msgs)
+
+    def open_message_log(self) -> MessageLog:
+        """
+        Open the on-disk log of the conversation, encrypted under a key derived from its first shared secret
+        Resumed exchanges keep the key, so they show the history of the conversation they continue. A new full exchange starts a new log,
+        unless both users pick the same secrets again
+        """
+        return MessageLog.for_key(self.log_dir, self.log_key or log_key(self.shared_secret))
+
+    @property
+    def url(self) -> str:
+        """
+        :return: URL of the remote user's server
+        """
+        return f"http://{self.remote_ip}:{self.remote_port}/"
+
+    def send_request_async(self, request_type: str, callback=None) -> Future:
+        """
+        Send a request to the remote user without waiting for it, after every request and message given before it
+        :param request_type: 'shared' for the shared parameters, 'public' for the public key, 'start_chat' to start messaging
+        :param callback: Called with the result of send_request when it is done, on a sending thread
+        :return: Future with the result of send_request
+        """
+        return self.queue_send(self.send_request, request_type, callback=callback)
+
+    def send_message_async(self, message: str, callback=None) -> Future:
+        """
+        Send a message to the remote user without waiting for it, the remote user delivers messages in the order they are given
+        :param message: The message to send
+        :param callback: Called with the result of send_message when it is done, on a sending thread
+        :return: Future with the result of send_message
+        """
+        return self.queue_send(self.send_message, message, callback=callback, messages=1)
+
+    def queue_send(self, fn, *args, callback=None, messages=0, block=False) -> Future:
+        """
+        Run a send function on the sending threads, passing its result to the callback
+        Requests start once every earlier send is done, and later sends start after them. The messages queued between two requests are
+        sent concurrently, fn gets the sequence number of its first message as seq so the remote user can deliver them in order
+        :param callback: Called with the result when it is done, on a sending thread. A send that raises gives False
+        :param messages: Number of messages sent by fn, 0 for a request
+        :param block: Wait for room when max_queued sends are queued, instead of failing
+        :return: Future with the result, already False if the queue is full or the sender is stopped
+        """
+        future = None
+        if self.send_slots.acquire(blocking=block):
+            with self.send_lock:
+                pending = [f for f in self.since_barrier if not f.done()]
+                after = [] if messages else pending  # Messages only wait for the last request, requests for every earlier send
+                if self.barrier is not None and not self.barrier.done():
+                    after.append(self.barrier)
+                kwargs = {"seq": self.send_seq} if messages else {}
+                try:
+                    future = self.sender.submit(self._send_after, after, fn, *args, **kwargs)
+                except RuntimeError:  # The sender has been shut down
+                    pass
+                else:
+                    if messages:
+                        self.send_seq += messages
+                        self.since_barrier = pending + [future]
+                    else:
+                        self.barrier, self.since_barrier = future, []
+            if future is None:
+                self.send_slots.release()
+            else:
+                future.add_done_callback(lambda f: self.send_slots.release())
+        if future is None:
+            future = Future()
+            future.set_result(False)
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(False if f.cancelled() or f.exception() else f.result()))
+        return future
+
+    @staticmethod
+    def _send_after(futures: list, fn, *args, **kwargs):
+        wait(futures)  # Queued earlier, so they are already running or ahead of us, and never wait on this send
+        return fn(*args, **kwargs)
+
+    def post(self, data: dict) -> dict | None:
+        """
+        Post data to the remote user, over a kept alive connection if one is available
+        Failed connections and timeouts are retried with exponential backoff
+        :param data: The request data
+        :return: The JSON response, or None if the connection failed
+        """
+        request_type = metrics.request_type(data)
+        start = time.perf_counter()
+        r = self._post(data)
+        metrics.SENDS.inc(request_type)
+        metrics.SEND_SECONDS.observe(time.perf_counter() - start, request_type)
+        if r is None or not r.get("success"):
+            metrics.SEND_ERRORS.inc(request_type)
+        return r
+
+    def _post(self, data: dict) -> dict | None:
+        if self.session_id is not None:
+            data["session"] = self.session_id
+        if self.wire_format == "binary":
+            body, content_type = wire.encode(data), wire.CONTENT_TYPE
+        else:
+            body, content_type = json.dumps(data, default=wire.to_hex).encode("utf-8"), "application/json"
+        for attempt in range(self.retries + 1):
+            try:
+                r = self.session.post(self.url, data=body, headers={"Content-Type": content_type}, timeout=self.timeout)  # Send the data
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:  # If the connection failed
+                # Messages are only sent again if they never reached the remote user, who would otherwise show them twice
+                retry = data.get("type") not in ("message", "message_batch") or self.never_sent(e)
+                if attempt == self.retries or not retry:
+                    print("Connection error")
+                    return None
+                time.sleep(self.backoff * 2 ** attempt)
+        if r.headers.get("Content-Type") == wire.CONTENT_TYPE:
+            return wire.decode(r.content)
+        return r.json()
+
+    @staticmethod
+    def never_sent(error: requests.exceptions.RequestException) -> bool:
+        """
+        :return: True if a request failed before any of it could reach the remote user
+        """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)  # The connection was refused
 
     def receive_request(self, data) -> dict:
         """
@@ -146,10 +741,30 @@ class DiffieHellman:
         :param data: The request data
         :return: The JSON response
         """
+        request_type = metrics.request_type(data)
+        start = time.perf_counter()
+        level = DEBUG if request_type in ("message", "message_batch") else INFO  # Messages are only traced at the debug level
+        with TRACER.span("receive." + request_type, level, session=data.get("session") if isinstance(data, dict) else None) as span:
+            response = self.handle_request(data)
+            span.set("success", response.get("success"))
+        metrics.REQUESTS.inc(request_type)
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, request_type)
+        if not response.get("success"):
+            metrics.REQUEST_ERRORS.inc(request_type)
+        return response
+
+    def handle_request(self, data) -> dict:
+        """
+        Answer a request, either from the session table or as the single remote user
+        :param data: The request data
+        :return: The JSON response
+        """
         try:
-            print("Received request: ", data)  # Print the received data
             response = {"name": self.name, "success": False}  # Create a response, success is False until updated
 
+            if "session" in data:  # Requests with a session ID are answered from the session table, without the control panel
+                return self.sessions.receive_request(data, response)
+
             # Check if the request is from the expected sender, does not help for security, but is nice to have
             if data["name"].lower() != self.remote_name.lower():
                 response["error"] = f"Wrong name, expected {self.remote_name}"
@@ -157,76 +772,168 @@ class DiffieHellman:
 
             match data["type"]:  # Match the type of the request
                 case "shared":  # If the request is for the shared parameters
-                    if "g" not in data or "p" not in data:  # Check if the parameters are present
-                        response["error"] = "Missing parameters"
-                        return response  # Return response, if parameters are missing
-                    self.p = data["p"]  # Set the shared parameters
-                    self.g = data["g"]
-                    CP.receive_shared(self.p, self.g)  # Update the control panel
+                    negotiated = protocol.negotiate(data, response)  # Check the proposed key agreement, parameters and mode
+                    if negotiated is None:
+                        return response  # Return response, if the proposal can't be accepted
+                    with self.lock:
+                        self.p = data.get("p", -1)  # Set the shared parameters
+                        self.g = data.get("g", -1)
+                        self.kex, self.cipher_mode = negotiated
+                    self.keypool.prepare(self.key_agreement)  # Fill the pool while the user picks a secret
+                    if self.ui is not None:
+                        self.ui.post("receive_shared", self.p, self.g)  # Update the control panel
                     response["success"] = True  # Set success as True
 
+                case "handshake":  # Shared parameters and public key in one request, answered with our public key
+                    negotiated = protocol.negotiate(data, response)
+                    if negotiated is None:
+                        return response
+                    if "public" not in data:
+                        response["error"] = "Missing parameters"
+                        return response
+                    with self.lock:
+                        self.p = data.get("p", -1)
+                        self.g = data.get("g", -1)
+                        self.kex, self.cipher_mode = negotiated
+                        self.generate_keypair()  # A fresh key pair from the pool, so we answer without a key calculation of our own
+                        self.remote_public = data["public"]
+                        self.calculate_shared_secret()
+                        response["public"] = self.public
+                    if self.ui is not None:
+                        self.ui.post("receive_shared", self.p, self.g)
+                        self.ui.post("set_state", "messaging")  # Skip straight to messaging
+                    response["status"] = "complete"
+                    response["success"] = True
+
                 case "public":  # If the request contains other party's public key
                     if "public" not in data:  # Check if the public key is present
                         response["error"] = "Missing parameters"
                         return response  # Return response, if public key is missing
 
-                    self.remote_public = data["public"]  # Set the remote public key value
-                    if self.public != -1:  # If we have our own public key, calculate the shared secret
-                        self.calculate_shared_secret()
-                    CP.receive_public(self.remote_public)  # Update the control panel with the remote public key
+                    with self.lock:
+                        self.remote_public = data["public"]  # Set the remote public key value
+                        if self.public != -1:  # If we have our own public key, calculate the shared secret
+                            self.calculate_shared_secret()
+                        public = self.public
+                    if self.ui is not None:
+                        self.ui.post("receive_public", data["public"])  # Update the control panel with the remote public key
 
                     # Status is pending, if we have not yet created our own public key
-                    response["status"] = "pending" if self.public == -1 else "complete"
+                    response["status"] = "pending" if public == -1 else "complete"
                     if response["status"] == "complete":
-                        response["public"] = self.public  # Send our public key, if we have already created it
+                        response["public"] = public  # Send our public key, if we have already created it
                     response["success"] = True
 
                 case "set_state":  # Request to change the state of the client
-                    if "state" not in data:  # Check if the parameter is present
-                        response["error"] = "Missing parameters"
-                        return response
-                    try:
-                        CP.state = data["state"]  # Set the state of the control panel
-                    except Exception as e:
-                        response["error"] = str(e)
+                    state = protocol.check_state(data, response)  # Check if the state is present and valid
+                    if state is None:
                         return response
+                    if self.ui is not None:
+                        self.ui.post("set_state", state)  # Set the state of the control panel
                     response["success"] = True
 
-                case "message":  # If the request contains a message
-                    if "message" not in data or "tag" not in data or "nonce" not in data:  # Check if all parameters are present
-                        response["error"] = "Missing parameters"
+                case "message" | "message_batch":  # If the request contains one or several messages
+                    checked = protocol.check_messages(data, response)  # Check if all parameters are present
+                    if checked is None:
                         return response  # Return response, if parameters are missing
-                    enc = Encryption(self.shared_secret)  # Create an encryption object
-                    msg = enc.decrypt(data["message"], data["tag"], data["nonce"])  # Decrypt the message
-                    CP.receive_message(msg)  # Update the control panel with the message
+                    msgs, seq = checked
+                    self.receive_messages([protocol.decrypt(self.cipher, msg, self.compute) for msg in msgs], seq)  # Decrypt the messages
                     response["success"] = True
 
+                case "resume":  # Request to continue the conversation with a new key, derived from a ticket
+                    resumed = tickets.answer(self.tickets, data, response)
+                    if resumed is None:
+                        return response
+                    with self.lock:
+                        self.shared_secret, self.cipher_mode, self.log_key = resumed
+                        self.tickets.issue(self.shared_secret, self.cipher_mode, self.url, self.log_key)
+                    if self.ui is not None:
+                        self.ui.post("set_state", "messaging")  # Skip straight to messaging
+
                 case _:
-                    response["error"] = "Invalid request type, expected 'shared', 'public' or 'message'"  # If the request type is invalid
+                    return protocol.invalid_type(response)  # If the request type is invalid
             return response
 
         except Exception as e:
             # If an error occurs, return a response with success as False
             return {"name": self.name, "success": False, "error": str(e)}
 
+    def receive_stream(self, read, headers) -> dict:
+        """
+        Receive a streamed file, and decrypt it to the download directory
+        :param read: Function reading exactly n bytes of the body, or fewer at the end of the body
+        :param headers: The request headers, with the name or session and the file name
+        :return: The JSON response
+        """
+        response = {"name": self.name, "success": False}
+        try:
+            session_id = headers.get("X-DH-Session")
+            if session_id is not None:
+                session = self.sessions.get(session_id)
+                if session is None or session.shared_secret == -1:
+                    response["error"] = "Unknown session"
+                    return response
+                cipher = session.cipher
+            else:
+                if headers.get("X-DH-Name", "").lower() != self.remote_name.lower():
+                    response["error"] = f"Wrong name, expected {self.remote_name}"
+                    return response
+                cipher = self.cipher
+
+            filename = os.path.basename(urllib.parse.unquote(headers.get("X-DH-Filename", "")))  # Never write outside the directory
+            if filename in ("", ".", ".."):
+                filename = "download"
+            os.makedirs(self.download_dir, exist_ok=True)
+            path = os.path.join(self.download_dir, filename)
+            part_path = f"{path}.{secrets.token_hex(4)}.part"  # Only moved into place once every chunk is verified
+            try:
+                with open(part_path, "wb") as out:
+                    response["size"] = streaming.decrypt_stream(cipher, read, out, headers.get("X-DH-Filename", "").encode("utf-8"))
+            except Exception:
+                os.remove(part_path)
+                raise
+            os.replace(part_path, path)
+
+            if self.ui is not None:
+                self.ui.post("receive_file", path)
+            if self.on_file is not None:
+                self.on_file(path)
+            response["success"] = True
+        except Exception as e:
+            response["error"] = str(e)
+        return response
+
     def start(self) -> None:
         """
         Start the server
         """
         server_address = ("", self.port)
         print("Starting server on ", server_address)
-        self.httpd = HTTPServer(server_address, DHHTTPHandler)
+        self.httpd = make_server(server_address, DHHTTPHandler, workers=self.workers)
+        self.httpd.dh = self  # Handlers pass requests to the DH that started the server
         self.server_thread.start()
 
     def stop(self) -> None:
         """
         Stop the server
         """
+        if self.batcher is not None:
+            self.batcher.close()  # Send the queued messages first
+        self.sender.shutdown(wait=False, cancel_futures=True)  # Don't wait on a remote user that doesn't answer
+        self.message_order.close()
+        self.keypool.close()
+        self.compute.close()
+        with self.lock:
+            channels = list(self.channels)
+        for channel_ in channels:
+            channel_.close()  # Frees the workers reading accepted channels
         try:
             self.httpd.shutdown()
+            self.httpd.server_close()
             self.server_thread.join(2)
         except (AttributeError, RuntimeError):  # If the server is not running
             pass
+        self.session.close()  # Close the kept alive connections
 
     def run_server(self) -> None:
         """
@@ -241,25 +948,121 @@ class DiffieHellman:
 
 def reset():
     global DH
-    global CP
     print("Resetting...")
     DH.stop()
-    DH = DiffieHellman(remote_ip=DH.remote_ip)
-    CP.DH = DH
-    CP.name_label.config(text="")  # Reset the name label
-    CP.state = 0
+    ui = DH.ui
+    DH = DiffieHellman(remote_ip=DH.remote_ip, workers=DH.workers, pool_size=DH.pool_size, wire_format=DH.wire_format,
+                       batch_window=DH.batch_window, batch_size=DH.batch_size, max_sessions=DH.sessions.max_sessions,
+                       session_timeout=DH.sessions.idle_timeout, cipher_mode=DH.cipher_mode, timeout=DH.timeout, retries=DH.retries,
+                       backoff=DH.backoff, kex=DH.kex,
+                       keypool_size=DH.keypool.size, tickets=DH.tickets, compute_workers=DH.compute_workers,
+                       max_channels=DH.max_channels, max_queued=DH.max_queued)  # Tickets are kept, so the conversation can be resumed
+    DH.ui = ui
+    ui.DH = DH
+    ui.name_label.config(text="")  # Reset the name label
+    ui.clear_history()
+    ui.state = 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Diffie-Hellman key exchange over HTTP")
+    parser.add_argument("remote_ip", nargs="?", default="127.0.0.1", help="IP of the remote user")
+    parser.add_argument("--workers", type=int, default=8, help="Number of request handling threads, 1 to handle one request at a time")
+    parser.add_argument("--wire-format", choices=["json", "binary"], default="json", help="Format of sent requests")
+    parser.add_argument("--cipher", choices=MODES, default="eax", help="AEAD mode proposed when starting an exchange")
+    parser.add_argument("--kex", choices=KEX, default="modp", help="Key agreement proposed when starting an exchange, mod-p or an elliptic curve")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Seconds to wait for the remote user before a request fails")
+    parser.add_argument("--retries", type=int, default=2, help="Number of retries of a failed request, with exponential backoff")
+    parser.add_argument("--headless", action="store_true", help="Run without the control panel")
+    parser.add_argument("--name", default="", help="Name of the user, Alice or Bob picks the ports")
+    parser.add_argument("--port", type=int, default=8080, help="Port to run the server on, when the name does not pick one")
+    parser.add_argument("--remote-port", type=int, default=8080, help="Port of the remote user, when the name does not pick one")
+    parser.add_argument("--connect", action="store_true", help="Start an exchange with the remote user, then send lines from stdin as messages")
+    parser.add_argument("--group", help="Standard group name or prime size in bits for the exchange, defaults to defaultValues.json")
+    parser.add_argument("--secret", type=int, help="Own secret key for the exchange, random by default")
+    parser.add_argument("--session", help="Session ID sent with the exchange, random by default")
+    parser.add_argument("--send-file", help="File to stream to the remote user after the exchange, instead of reading messages")
+    parser.add_argument("--compute-workers", type=int, default=0, help="Processes for key calculations and large encryptions, 0 to run them on the request threads")
+    parser.add_argument("--channel", action="store_true", help="Send messages over a channel opened after the exchange, instead of one request each")
+    parser.add_argument("--trace", help="Trace file to write spans of each exchange phase to, in the Chrome trace event format")
+    parser.add_argument("--trace-level", choices=list(tracing.LEVELS), default="info", help="Lowest level of traced spans, debug includes messages")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="Fraction of spans to trace")
+    return parser.parse_args()
+
+
+def run_headless(args) -> None:
+    """
+    Run without the control panel. Serves exchanges from remote users, or starts one with --connect
+    An exchange we start uses a session, so the remote user answers over the same connections and we need no server of our own
+    """
+    global DH
+    DH = DiffieHellman(port=args.port, remote_ip=args.remote_ip, remote_port=args.remote_port, workers=args.workers, wire_format=args.wire_format,
+                       cipher_mode=args.cipher, timeout=args.timeout, retries=args.retries, kex=args.kex, compute_workers=args.compute_workers)
+    DH.name = args.name
+    DH.on_message = lambda msgs: [print(f"Received message: {msg}") for msg in msgs]
+    DH.sessions.on_message = lambda session_id, msgs: [print(f"Received message ({session_id}): {msg}") for msg in msgs]
+    DH.on_file = lambda path: print(f"Received file: {path}")
+
+    try:
+        if not args.connect:
+            DH.start()
+            DH.server_thread.join()  # Serve until interrupted
+            return
+
+        if args.kex == "modp":  # Curves have no shared parameters to pick
+            if args.group:
+                from groups import get_group
+                DH.g, DH.p = get_group(args.group)
+            else:
+                with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "defaultValues.json"), "r") as f:
+                    default_values = json.loads(f.read())
+                DH.g, DH.p = default_values["g"], default_values["p"]
+        DH.session_id = args.session or secrets.token_hex(8)  # The remote user answers the exchange from its session table
+        if args.secret is not None:
+            DH.secret = args.secret
+            DH.calculate_public_key()
+        else:
+            DH.generate_keypair()
+        handshake = DH.send_request("handshake")
+        if not handshake and DH.last_error is not None and DH.last_error.startswith("Invalid request type"):
+            # Only servers without the combined handshake get the three requests, not servers that are down or refused it
+            handshake = DH.send_request("shared") and DH.send_request("public") and DH.send_request("start_chat")
+        if not handshake:
+            print("Key exchange failed")
+            return
+        print(f"Shared secret established, session {DH.session_id}")
+        if args.channel and not DH.open_channel():
+            print("Channel refused, sending messages as requests")
+        if args.send_file:
+            print("File sent" if DH.send_file(args.send_file) else "File was not delivered")
+            return
+        for line in sys.stdin:  # Lines read in a burst are sent together
+            if line.strip():
+                DH.queue_message(line.rstrip("\n"), callback=lambda sent: sent or print("Message was not delivered"))
+        DH.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        DH.stop()
 
 
 def main():
     global DH
     global CP
 
-    remote_ip = "127.0.0.1"
-    if len(sys.argv) > 1:
-        remote_ip = sys.argv[1]
+    args = parse_args()
+    if args.trace:
+        tracing.configure(args.trace, args.trace_level, args.trace_sample)
+    if args.headless:
+        run_headless(args)
+        print("Exiting...")
+        return
 
-    DH = DiffieHellman(remote_ip=remote_ip)
+    from ControlPanel import ControlPanel  # Only load tkinter and the UI config when the control panel is used
+    DH = DiffieHellman(remote_ip=args.remote_ip, workers=args.workers, wire_format=args.wire_format, cipher_mode=args.cipher,
+                       timeout=args.timeout, retries=args.retries, kex=args.kex, compute_workers=args.compute_workers)
     CP = ControlPanel(DH)
+    DH.ui = CP
     CP.start()
 
     DH.stop()
@@ -268,5 +1071,5 @@ def main():
 
 if __name__ == "__main__":
     DH: DiffieHellman = None
-    CP: ControlPanel = None
+    CP = None  # The ControlPanel, only created when running with the control panel
     main()
@@ -0,0 +1,158 @@
+from concurrent.futures import Future
+import threading
+import time
+
+GAP_TIMEOUT = 5.0  # Seconds received messages wait for an earlier message, which may have been lost
+
+
+class MessageBatcher:
+    """
+    Collects messages queued close together, and sends them as a single batch
+    """
+
+    def __init__(self, send, window=0.05, max_size=32, on_sent=None, max_pending=1024):
+        self.send = send  # Function sending a list of messages, returns whether it succeeded or a future of that
+        self.window = window  # Seconds to wait for more messages, after the first message of a batch
+        self.max_size = max_size  # Largest number of messages in one batch
+        self.max_pending = max_pending  # Largest number of messages waiting to be sent, put blocks until there is room
+        self.on_sent = on_sent  # Called with the batch and whether it was sent, if given
+
+        self.pending = []  # Messages waiting to be sent, with their callbacks
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)  # Thread sending the batches
+        self.thread.start()
+
+    def put(self, message: str, callback=None) -> None:
+        """
+        Queue a message, to be sent with the next batch
+        Waits while max_pending messages are waiting, so a sender that can't keep up slows down the caller
+        :param callback: Called with whether the message was sent, once its batch is done
+        """
+        with self.condition:
+            while self.running and len(self.pending) >= self.max_pending:
+                self.condition.wait()
+            if not self.running:
+                raise RuntimeError("Batcher is closed")
+            self.pending.append((message, callback))
+            if len(self.pending) == 1 or len(self.pending) >= self.max_size:  # Wake the sender on a new or full batch
+                self.condition.notify_all()
+
+    def next_batch(self) -> list[tuple]:
+        """
+        Wait until a batch is complete, either by size or by the time window running out
+        :return: The messages of the batch and their callbacks, empty when closed with nothing left to send
+        """
+        with self.condition:
+            while not self.pending and self.running:
+                self.condition.wait()
+            deadline = time.monotonic() + self.window
+            while self.running and len(self.pending) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_size]
+            del self.pending[:self.max_size]
+            self.condition.notify_all()  # Wake callers waiting for room
+            return batch
+
+    def run(self) -> None:
+        """
+        Function to send the batches in a thread
+        """
+        while True:
+            batch = self.next_batch()
+            if not batch:  # Closed, and everything has been sent
+                return
+            try:
+                result = self.send([message for message, _ in batch])
+            except Exception:
+                result = False
+            if isinstance(result, Future):  # Sent in the background, the next batch is collected meanwhile
+                result.add_done_callback(lambda f, batch=batch: self.sent(batch, not f.cancelled() and f.exception() is None and f.result()))
+            else:
+                self.sent(batch, result)
+
+    def sent(self, batch: list[tuple], success: bool) -> None:
+        """
+        Report the result of a batch to on_sent and the callback of each message
+        """
+        if self.on_sent is not None:
+            self.on_sent([message for message, _ in batch], success)
+        for _, callback in batch:
+            if callback is not None:
+                callback(success)
+
+    def close(self, timeout=2) -> None:
+        """
+        Send the remaining messages and stop the sending thread
+        :param timeout: Seconds to wait for the remaining batches to be handed to send, None to wait until they are
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+
+class MessageOrder:
+    """
+    Delivers received messages in the order they were sent, as the requests carrying them may be handled concurrently
+    Each request or frame carries the sequence number of its first message. Messages that arrive before an earlier one wait for it, for
+    at most gap_timeout seconds, as the request with the earlier message may have failed
+    """
+
+    def __init__(self, deliver, gap_timeout=GAP_TIMEOUT, max_early=1024):
+        self.deliver = deliver  # Called with each list of messages, in the order they were sent
+        self.gap_timeout = gap_timeout  # Seconds messages wait for an earlier message before they are delivered anyway
+        self.max_early = max_early  # Largest number of early requests kept, the gap is skipped when there are more
+        self.next = 0  # Sequence number of the next message to deliver
+        self.early = {}  # Sequence number: messages that arrived before an earlier message
+        self.timer = None  # Skips the gap once it has lasted gap_timeout seconds
+        self.lock = threading.Lock()
+
+    def receive(self, seq: int, msgs: list) -> None:
+        """
+        Deliver messages once every earlier message has been delivered
+        :param seq: Sequence number of the first message
+        """
+        with self.lock:  # Delivered with the lock held, so two threads never deliver out of order
+            if seq < self.next:  # Arrived after its gap was skipped
+                self.deliver(msgs)
+                return
+            self.early[seq] = msgs
+            if len(self.early) > self.max_early:
+                self.next = min(self.early)
+            self._deliver_ready()
+
+    def skip_gap(self) -> None:
+        """
+        Deliver the messages waiting for an earlier message that never arrived
+        """
+        with self.lock:
+            self.timer = None
+            if self.early:
+                self.next = min(self.early)
+                self._deliver_ready()
+
+    def _deliver_ready(self) -> None:
+        """
+        Must be called with the lock held
+        """
+        while self.next in self.early:
+            msgs = self.early.pop(self.next)
+            self.next += len(msgs)
+            self.deliver(msgs)
+        if not self.early and self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        elif self.early and self.timer is None:
+            self.timer = threading.Timer(self.gap_timeout, self.skip_gap)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
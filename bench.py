@@ -0,0 +1,142 @@
+from DH import DiffieHellman
+from encryption import Encryption, MODES
+from groups import STANDARD_GROUPS
+from keyagreement import CURVES
+
+from contextlib import redirect_stderr, redirect_stdout
+import argparse
+import json
+import os
+import platform
+import secrets
+import statistics
+import time
+
+GROUPS = {"default": (127, 199), **{name: STANDARD_GROUPS[name] for name in ("modp1536", "modp2048", "modp3072", "modp4096")}}
+MESSAGE_SIZES = [16, 256, 4096, 65536, 1048576]
+
+
+def measure(fn, repeat: int, warmup=1) -> dict:
+    """
+    Time repeated calls of a function
+    :param fn: Function to call, without arguments
+    :param repeat: Number of timed calls
+    :param warmup: Number of untimed calls made first
+    :return: Latency statistics in milliseconds, and calls per second
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        "repeat": repeat,
+        "mean_ms": statistics.fmean(times) * 1e3,
+        "p50_ms": times[len(times) // 2] * 1e3,
+        "p99_ms": times[min(len(times) - 1, int(len(times) * 0.99))] * 1e3,
+        "ops_per_sec": len(times) / sum(times) if sum(times) else 0.0,
+    }
+
+
+def bench_modexp(repeat: int) -> list[dict]:
+    """
+    Benchmark key calculation for each group and elliptic curve
+    """
+    results = []
+    for name, kex, g, p in [(name, "modp", g, p) for name, (g, p) in GROUPS.items()] + [(name, name, -1, -1) for name in CURVES]:
+        dh = DiffieHellman(g=g, p=p, kex=kex)
+        dh.keypool.choose(dh.key_agreement)  # Timed like a group picked by the local user, which gets a fixed-base table
+        agreement = dh.key_agreement
+        dh.remote_public = agreement.public_key(agreement.random_secret())
+        bits = p.bit_length() if kex == "modp" else None
+
+        def public_key():
+            dh.secret = agreement.random_secret()
+            dh.calculate_public_key()
+
+        results.append({"name": "calculate_public_key", "group": name, "kex": kex, "bits": bits, **measure(public_key, repeat)})
+        results.append({"name": "calculate_shared_secret", "group": name, "kex": kex, "bits": bits, **measure(dh.calculate_shared_secret, repeat)})
+        dh.stop()
+    return results
+
+
+def bench_encryption(repeat: int) -> list[dict]:
+    """
+    Benchmark encryption and decryption throughput for each mode and message size
+    """
+    results = []
+    key = secrets.randbits(256)
+    for mode in MODES:
+        enc = Encryption(key, mode)
+        for size in MESSAGE_SIZES:
+            plaintext = secrets.token_bytes(size)
+            ct, tag, nonce = enc.encrypt_bytes(plaintext)
+            for name, fn in (("encrypt", lambda: enc.encrypt_bytes(plaintext)), ("decrypt", lambda: enc.decrypt_bytes(ct, tag, nonce))):
+                result = measure(fn, repeat)
+                result["mb_per_sec"] = result["ops_per_sec"] * size / 1e6
+                result["ns_per_byte"] = result["mean_ms"] * 1e6 / size
+                results.append({"name": name, "mode": mode, "size": size, **result})
+    return results
+
+
+def bench_loopback(repeat: int, group="modp2048") -> list[dict]:
+    """
+    Benchmark handshakes and messages through a real server on the loopback interface
+    """
+    g, p = GROUPS[group]
+    server = DiffieHellman(port=0, name="server")
+    server.start()
+    port = server.httpd.server_address[1]
+    results = []
+    try:
+        for wire_format in ("json", "binary"):
+            client = DiffieHellman(name="client", remote_ip="127.0.0.1", remote_port=port, wire_format=wire_format,
+                                   session_id=f"bench-{wire_format}", g=g, p=p)
+
+            def handshake():
+                client.secret = secrets.randbelow(p - 3) + 2
+                client.calculate_public_key()
+                assert client.send_request("shared") and client.send_request("public") and client.send_request("start_chat")
+
+            results.append({"name": "handshake", "group": group, "wire_format": wire_format, **measure(handshake, max(1, repeat // 10))})
+            for size in (16, 4096):
+                message = "x" * size
+                results.append({"name": "message", "size": size, "wire_format": wire_format, **measure(lambda: client.send_message(message), repeat)})
+            client.stop()
+    finally:
+        server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark key exchange, encryption and HTTP round trips")
+    parser.add_argument("-o", "--output", help="File to write the JSON results to, defaults to stdout")
+    parser.add_argument("-n", "--repeat", type=int, default=100, help="Number of timed calls per benchmark")
+    parser.add_argument("--only", choices=["modexp", "encryption", "loopback"], action="append", help="Only run the given suites")
+    args = parser.parse_args()
+
+    suites = {"modexp": bench_modexp, "encryption": bench_encryption, "loopback": bench_loopback}
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": {},
+    }
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull), redirect_stderr(devnull):  # Keep request logging out of the timings
+        for name in args.only or suites:
+            report["results"][name] = suites[name](args.repeat)
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Long-lived encrypted channel between two users, opened with an HTTP Upgrade on the server's port once the key exchange is done
+
+After the 101 response both sides write frames to the same connection, each laid out as:
+    ciphertext length (4 bytes) | kind (1 byte) | nonce length (1 byte) | nonce | tag (16 bytes) | ciphertext
+The channel ID, the direction, a sequence number and the kind are authenticated with each frame, so frames can't be replayed,
+reordered, reflected back to their sender or moved to another channel.
+Each channel is read on its own thread, so accepted channels don't hold the server's workers, and is closed after IDLE_TIMEOUT
+seconds without frames in either direction.
+"""
+from encryption import Encryption
+import metrics
+
+import secrets
+import socket
+import struct
+import threading
+import time
+
+PROTOCOL = "dh-channel"  # Value of the Upgrade header
+PATH = "/channel"
+NONCE_SIZE = 16  # Bytes of each side's part of the channel ID
+MAX_FRAME = 16 * 1024 * 1024  # Largest ciphertext accepted from the remote user
+TAG_SIZE = 16
+IDLE_TIMEOUT = 300.0  # Seconds without frames before a channel is closed
+MAX_HEADER_SIZE = 65536  # Largest upgrade response accepted
+
+MESSAGE = 1  # Frame kinds
+CLOSE = 2
+ORDERED = 3  # Message starting with its sequence number, as frames can be written by several sending threads
+
+_FRAME = struct.Struct(">IBB")  # Ciphertext length, kind and nonce length
+_HEADER = struct.Struct(">16s16scQB")  # Channel ID, direction, sequence number and kind, authenticated with each frame
+_SEQ = struct.Struct(">Q")  # Sequence number of an ordered message
+
+
+class Channel:
+    """
+    One side of a channel. Frames are written by any thread, and read by the thread running run()
+    """
+
+    def __init__(self, sock: socket.socket, cipher: Encryption, initiator: bool, channel_id: tuple[bytes, bytes], on_message=None,
+                 on_close=None, buffered=b"", idle_timeout=IDLE_TIMEOUT):
+        self.sock = sock
+        self.buffer = bytearray(buffered)  # Received bytes not yet read as frames, starting with any read past the upgrade response
+        self.idle_timeout = idle_timeout  # Seconds without frames before the channel is closed
+        self.last_active = time.monotonic()  # Time a frame was last sent or received
+        sock.settimeout(idle_timeout)  # Wakes up the reading thread to check for idleness
+        self.cipher = cipher  # Encryption for the shared key
+        self.channel_id = channel_id  # Nonces of the client and the server
+        self.direction = b"c" if initiator else b"s"  # Direction of our frames, the remote user's are the other one
+        self.remote_direction = b"s" if initiator else b"c"
+        self.on_message = on_message  # Called with a list of received messages and their sequence number or None, if given
+        self.on_close = on_close  # Called with the channel once it is closed, if given
+        self.send_sequence = 0
+        self.receive_sequence = 0
+        self.write_lock = threading.Lock()
+        self.open = True
+
+    def header(self, direction: bytes, sequence: int, kind: int) -> bytes:
+        return _HEADER.pack(*self.channel_id, direction, sequence, kind)
+
+    def send(self, message: str, kind=MESSAGE, seq: int = None) -> bool:
+        """
+        Encrypt a message and write it as a frame
+        :param seq: Sequence number of the message, the remote user delivers messages with one in order
+        :return: True if the frame was written, False if the channel is closed
+        """
+        data = message.encode("utf-8")
+        if seq is not None:
+            kind, data = ORDERED, _SEQ.pack(seq) + data
+        with self.write_lock:
+            if not self.open:
+                return False
+            ct, tag, nonce = self.cipher.encrypt_bytes(data, header=self.header(self.direction, self.send_sequence, kind))
+            self.send_sequence += 1
+            try:
+                self.sock.sendall(_FRAME.pack(len(ct), kind, len(nonce)) + nonce + tag + ct)
+                sent = True
+            except OSError:
+                sent = False
+        if not sent:
+            self.close(notify=False)
+            return False
+        self.last_active = time.monotonic()
+        metrics.CHANNEL_FRAMES.inc("sent")
+        return True
+
+    def read(self, sock: socket.socket, n: int) -> bytes | None:
+        """
+        :return: The next n bytes received, or None if the connection was closed or has been idle for too long
+        """
+        while len(self.buffer) < n:
+            try:
+                data = sock.recv(max(65536, n - len(self.buffer)))
+            except TimeoutError:
+                if time.monotonic() - self.last_active >= self.idle_timeout:
+                    return None
+                continue  # Frames were sent meanwhile, the channel is still in use
+            if not data:
+                return None
+            self.buffer += data
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    def run(self) -> None:
+        """
+        Read frames until the channel is closed, passing each message to on_message
+        """
+        sock = self.sock
+        try:
+            while self.open:
+                frame = self.read(sock, _FRAME.size)
+                if frame is None:
+                    break  # The remote user closed the connection, or it was idle
+                length, kind, nonce_length = _FRAME.unpack(frame)
+                if length > MAX_FRAME:
+                    break
+                body = self.read(sock, nonce_length + TAG_SIZE + length)
+                if body is None:
+                    break
+                body = memoryview(body)
+                nonce, tag, ct = body[:nonce_length], body[nonce_length:nonce_length + TAG_SIZE], body[nonce_length + TAG_SIZE:]
+                message = self.cipher.decrypt_bytes(ct, tag, nonce, header=self.header(self.remote_direction, self.receive_sequence, kind))
+                if message is False:  # Forged or out of order, the rest of the stream can't be trusted
+                    break
+                self.receive_sequence += 1
+                self.last_active = time.monotonic()
+                metrics.CHANNEL_FRAMES.inc("received")
+                if kind == CLOSE:
+                    break
+                if kind == MESSAGE and self.on_message is not None:
+                    self.on_message([message.decode("utf-8")], None)
+                elif kind == ORDERED and self.on_message is not None and len(message) >= _SEQ.size:
+                    self.on_message([message[_SEQ.size:].decode("utf-8")], _SEQ.unpack_from(message)[0])
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.close(notify=False)
+            sock.close()
+
+    def start(self) -> threading.Thread:
+        """
+        Read frames on a background thread
+        """
+        thread = threading.Thread(target=self.run, name="dh-channel", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self, notify=True) -> None:
+        """
+        Close the channel, telling the remote user first if notify is set
+        """
+        if notify and self.open:
+            self.send("", CLOSE)
+        with self.write_lock:
+            was_open = self.open or self.sock is not None
+            self.open = False
+            sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # Wakes up the thread blocked in run()
+            except OSError:
+                pass
+        if was_open and self.on_close is not None:
+            self.on_close(self)
+
+
+def connect(host: str, port: int, cipher: Encryption, headers: dict, timeout=5.0, on_message=None, on_close=None,
+            idle_timeout=IDLE_TIMEOUT) -> Channel:
+    """
+    Open a channel to the remote user's server
+    :param headers: Headers identifying us, the name or the session
+    :param timeout: Seconds to wait for the connection and the upgrade response
+    :param idle_timeout: Seconds without frames before the channel is closed
+    :return: The open channel, reading on a background thread
+    :raises OSError: If the connection failed
+    :raises ValueError: If the server refused the upgrade
+    """
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Frames are small and written whole
+        client_nonce = secrets.token_bytes(NONCE_SIZE)
+        lines = [f"GET {PATH} HTTP/1.1", f"Host: {host}:{port}", "Connection: Upgrade", f"Upgrade: {PROTOCOL}",
+                 f"X-DH-Channel-Nonce: {client_nonce.hex()}"] + [f"{key}: {value}" for key, value in headers.items()]
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode("utf-8"))
+
+        received = b""  # Read from the socket directly, as the server may send frames right after the response
+        while b"\r\n\r\n" not in received:
+            data = sock.recv(4096)
+            if not data or len(received) > MAX_HEADER_SIZE:
+                raise ValueError("Connection closed during the upgrade")
+            received += data
+        head, _, buffered = received.partition(b"\r\n\r\n")
+        status_line, *lines = head.decode("latin-1").split("\r\n")
+        status = status_line.split(None, 2)
+        response_headers = {}
+        for line in lines:
+            key, _, value = line.partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+        if len(status) < 2 or status[1] != "101":
+            raise ValueError(f"Upgrade refused: {status_line.strip()}")
+        server_nonce = bytes.fromhex(response_headers.get("x-dh-channel-nonce", ""))
+        if len(server_nonce) != NONCE_SIZE:
+            raise ValueError("Upgrade response has no channel nonce")
+    except BaseException:
+        sock.close()
+        raise
+    channel = Channel(sock, cipher, True, (client_nonce, server_nonce), on_message=on_message, on_close=on_close, buffered=buffered,
+                      idle_timeout=idle_timeout)
+    channel.start()
+    return channel
+
+
+def accept(handler, cipher: Encryption, on_message=None, on_close=None, idle_timeout=IDLE_TIMEOUT) -> Channel | None:
+    """
+    Answer an upgrade request with 101 and take over its connection, the client only sends frames once it has the response
+    :param handler: The request handler of the upgrade request, its server must be able to detach the connection
+    :param idle_timeout: Seconds without frames before the channel is closed
+    :return: The channel, reading on a background thread, or None if the request has no valid nonce
+    """
+    try:
+        client_nonce = bytes.fromhex(handler.headers.get("X-DH-Channel-Nonce", ""))
+    except ValueError:
+        client_nonce = b""
+    if len(client_nonce) != NONCE_SIZE:
+        handler.send_error(400, "Missing channel nonce")
+        return None
+    server_nonce = secrets.token_bytes(NONCE_SIZE)
+    handler.send_response(101)
+    handler.send_header("Connection", "Upgrade")
+    handler.send_header("Upgrade", PROTOCOL)
+    handler.send_header("X-DH-Channel-Nonce", server_nonce.hex())
+    handler.end_headers()
+    handler.close_connection = True  # The connection is no longer HTTP, the handler returns and frees its worker
+    handler.server.detach(handler.connection)  # Closed by the channel instead
+    channel = Channel(handler.connection, cipher, False, (client_nonce, server_nonce), on_message=on_message, on_close=on_close,
+                      idle_timeout=idle_timeout)
+    channel.start()
+    return channel
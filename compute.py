@@ -0,0 +1,112 @@
+"""
+Optional process pool for CPU-heavy work, so key calculations and large encryptions of concurrent exchanges use every core
+
+Python integer exponentiation holds the GIL, so on the threaded server every handshake shares one core. Work handed to the pool runs in
+worker processes, while the request thread waits on its future without holding the GIL.
+Each worker has its own fixed-base table cache, so the memory of the tables (up to fixedbase.CACHE.max_bytes) is multiplied by the
+number of workers. Workers build the table of a trusted group on its first use, as each of them would otherwise calculate without it a few
+times. Groups proposed by remote users never get a table, in the workers or in the main process.
+"""
+import fixedbase
+from keyagreement import KeyAgreement
+import metrics
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import time
+
+MIN_CIPHER_BYTES = 64 * 1024  # Smaller messages are encrypted inline, as sending them to a worker costs more than the encryption
+
+
+def keypair(agreement: KeyAgreement) -> tuple[int, int]:
+    """
+    :return: A new random secret and its public key
+    """
+    secret = agreement.random_secret()
+    return secret, agreement.public_key(secret)
+
+
+def _init_worker() -> None:
+    # Workers are long-lived and only do key calculations, so tables of trusted groups pay off right away. Untrusted groups are never
+    # counted, so this can't make a worker build a table for a group proposed by a remote user
+    fixedbase.CACHE.build_after = 1
+
+
+class _Inline:
+    """
+    Executor used when no compute workers are configured, running everything on the calling thread
+    """
+    __slots__ = ()
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def run(self, fn, *args):
+        return fn(*args)
+
+    def run_cipher(self, fn, data, *args):
+        return fn(data, *args)
+
+    def close(self) -> None:
+        pass
+
+
+INLINE = _Inline()
+
+
+class ComputeExecutor:
+    """
+    Runs key calculations and large encryptions in worker processes
+    Functions and their arguments are pickled, so bound methods of key agreements and ciphers can be passed as they are
+    """
+
+    def __init__(self, workers: int = None, min_cipher_bytes=MIN_CIPHER_BYTES):
+        self.workers = workers or multiprocessing.cpu_count()  # Number of worker processes, defaults to one per core
+        self.min_cipher_bytes = min_cipher_bytes  # Smallest message encrypted or decrypted in a worker
+        # Workers are spawned rather than forked, as forking a process with running threads can copy held locks
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker)
+
+    def submit(self, fn, *args) -> Future:
+        """
+        Run a function in a worker process
+        :return: Future with the result, set on a thread of the executor
+        """
+        args = tuple(bytes(arg) if isinstance(arg, memoryview) else arg for arg in args)  # Views of a read buffer can't be pickled
+        return self.executor.submit(fn, *args)
+
+    def run(self, fn, *args):
+        """
+        Run a function in a worker process, and wait for its result
+        The function runs inline if the pool has been closed or a worker died, errors raised by the function itself are passed on
+        """
+        start = time.perf_counter()
+        try:
+            future = self.submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError):  # RuntimeError when submitting after close()
+            return fn(*args)
+        try:
+            result = future.result()
+        except BrokenProcessPool:  # A worker died before the function returned
+            return fn(*args)
+        metrics.COMPUTE_SECONDS.observe(time.perf_counter() - start, getattr(fn, "__name__", "other"))
+        return result
+
+    def run_cipher(self, fn, data, *args):
+        """
+        Run an encryption or decryption in a worker process if the data is large enough to be worth sending there
+        :param fn: encrypt_bytes or decrypt_bytes of a cipher
+        :param data: The plaintext or ciphertext
+        """
+        if len(data) < self.min_cipher_bytes:
+            return fn(data, *args)
+        return self.run(fn, data, *args)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
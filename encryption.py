@@ -1,9 +1,20 @@
-from Crypto.Cipher import AES
+from Crypto.Cipher import AES, ChaCha20_Poly1305
+from Crypto.Hash import SHA256
+from Crypto.Random import get_random_bytes
+import metrics
+
+import time
+
+MODES = ["eax", "gcm", "chacha20-poly1305"]  # Supported AEAD modes, EAX is the default for compatibility
 
 
 class Encryption:
-    def __init__(self, key):
+    def __init__(self, key, mode="eax"):
+        if mode not in MODES:
+            raise ValueError(f"Unsupported cipher mode {mode}, expected one of {', '.join(MODES)}")
+        self.mode = mode  # AEAD mode used for every message
         self._key = b""
+        self._stream_key = b""  # 256-bit key for ChaCha20-Poly1305
         self.key = key
 
     @property
@@ -16,44 +27,95 @@ class Encryption:
             self._key = value.to_bytes(16, "big")
         elif value < 2 ** (24*8):
             self._key = value.to_bytes(24, "big")
-        else:
+        elif value < 2 ** (32*8):
             self._key = value.to_bytes(32, "big")
+        else:  # Shared secrets from large groups are hashed down to a 256-bit key
+            self._key = SHA256.new(value.to_bytes((value.bit_length() + 7) // 8, "big")).digest()
+        # ChaCha20 only takes 256-bit keys, so shorter keys are stretched by hashing
+        self._stream_key = self._key if len(self._key) == 32 else SHA256.new(self._key).digest()
+
+    def new_cipher(self, nonce=None):
+        """
+        Create a cipher object for the mode
+        :param nonce: Nonce of a received message, a random nonce is picked when encrypting
+        """
+        match self.mode:
+            case "gcm":
+                return AES.new(self.key, AES.MODE_GCM, nonce=get_random_bytes(12) if nonce is None else nonce)
+            case "chacha20-poly1305":
+                return ChaCha20_Poly1305.new(key=self._stream_key, nonce=nonce)
+            case _:
+                return AES.new(self.key, AES.MODE_EAX, nonce=nonce)
 
     def encrypt(self, plaintext: str) -> tuple[str, str, str]:
         """
-        Encrypts a plaintext with AES
+        Encrypts a plaintext with the AEAD mode
         :param plaintext: String to encrypt
         :return: ciphertext, tag and nonce as hex strings
         """
-        cipher = AES.new(self.key, AES.MODE_EAX)
-        ct, tag = cipher.encrypt_and_digest(plaintext.encode("utf-8"))
-        return ct.hex(), tag.hex(), cipher.nonce.hex()
+        ct, tag, nonce = self.encrypt_bytes(plaintext.encode("utf-8"))
+        return ct.hex(), tag.hex(), nonce.hex()
 
     def decrypt(self, ciphertext: str, tag: str, nonce: str) -> str | bool:
         """
-        Decrypts a HEX string with AES
+        Decrypts a HEX string with the AEAD mode
         :param ciphertext: The ciphertext to decrypt
         :param tag: The tag to verify decryption
         :param nonce: The nonce to use for decryption
         :return: The decrypted string or False if the decryption failed
         """
-        cipher = AES.new(self.key, AES.MODE_EAX, nonce=bytes.fromhex(nonce))
-        plaintext = cipher.decrypt(bytes.fromhex(ciphertext))
+        plaintext = self.decrypt_bytes(bytes.fromhex(ciphertext), bytes.fromhex(tag), bytes.fromhex(nonce))
+        if plaintext is False:
+            return False
+        return plaintext.decode("utf-8")
+
+    def encrypt_bytes(self, plaintext: bytes, header=b"") -> tuple[bytes, bytes, bytes]:
+        """
+        Encrypts raw bytes with the AEAD mode
+        :param plaintext: Bytes to encrypt
+        :param header: Data that is authenticated by the tag, but not encrypted
+        :return: ciphertext, tag and nonce as bytes
+        """
+        start = time.perf_counter()
+        cipher = self.new_cipher()
+        if header:
+            cipher.update(header)
+        ct, tag = cipher.encrypt_and_digest(plaintext)
+        metrics.CIPHER_SECONDS.observe(time.perf_counter() - start, "encrypt", self.mode)
+        metrics.CIPHER_BYTES.inc("encrypt", self.mode, amount=len(plaintext))
+        return ct, tag, cipher.nonce
+
+    def decrypt_bytes(self, ciphertext: bytes, tag: bytes, nonce: bytes, header=b"") -> bytes | bool:
+        """
+        Decrypts raw bytes with the AEAD mode
+        :param ciphertext: The ciphertext to decrypt, any bytes-like object
+        :param tag: The tag to verify decryption
+        :param nonce: The nonce to use for decryption
+        :param header: Data that was authenticated with the ciphertext
+        :return: The decrypted bytes or False if the decryption failed
+        """
+        start = time.perf_counter()
+        cipher = self.new_cipher(nonce)
+        if header:
+            cipher.update(header)
+        plaintext = cipher.decrypt(ciphertext)
 
         try:
-            cipher.verify(bytes.fromhex(tag))
+            cipher.verify(tag)
         except ValueError:
-            return False
-
-        return plaintext.decode("utf-8")
+            plaintext = False
+        metrics.CIPHER_SECONDS.observe(time.perf_counter() - start, "decrypt", self.mode)
+        metrics.CIPHER_BYTES.inc("decrypt", self.mode, amount=len(ciphertext))
+        return plaintext
 
 
 def main():
     key = 15
-    enc = Encryption(key)
-    ct, tag, nonce = enc.encrypt("Hello World")
-    print(ct, tag, nonce)
-    print(enc.decrypt(ct, tag, nonce))
+    for mode in MODES:
+        enc = Encryption(key, mode)
+        ct, tag, nonce = enc.encrypt("Hello World")
+        print(mode, ct, tag, nonce)
+        print(enc.decrypt(ct, tag, nonce))
 
 
 if __name__ == '__main__':
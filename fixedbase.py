@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+
+
+class FixedBaseTable:
+    """
+    Precomputed powers of a fixed base, so an exponentiation only needs one multiplication per window of the exponent
+    """
+
+    def __init__(self, g: int, p: int, window=5, bits=None):
+        self.g = g
+        self.p = p
+        self.window = window  # Number of exponent bits handled by each table lookup
+        self.bits = bits or p.bit_length()  # Largest exponent size covered by the table
+        self.mask = (1 << window) - 1
+
+        # table[i * 2^window + d] = g^(d * 2^(window * i)) mod p
+        rows = (self.bits + window - 1) // window
+        self.table = []
+        base = g % p
+        for _ in range(rows):
+            power = 1
+            row = [1]
+            for _ in range(self.mask):
+                power = power * base % p
+                row.append(power)
+            self.table += row
+            base = power * base % p  # g^(2^(window * (i + 1)))
+
+    def pow(self, exponent: int) -> int:
+        """
+        :return: g^exponent mod p
+        """
+        if exponent < 0 or exponent.bit_length() > self.bits:  # Not covered by the table
+            return pow(self.g, exponent, self.p)
+        table, mask, window, p = self.table, self.mask, self.window, self.p
+        result = 1
+        offset = 0
+        while exponent:
+            digit = exponent & mask
+            if digit:
+                result = result * table[offset + digit] % p
+            exponent >>= window
+            offset += mask + 1
+        return result % p
+
+
+class FixedBaseCache:
+    """
+    Bounded cache of fixed base tables, keyed by (g, p)
+    A table is built once a trusted group has been used build_after times, as building one costs about as much as a few exponentiations
+    Tables are bounded by their estimated size as well as their number, as a table for an 8192-bit group takes about 50 MB
+    """
+
+    def __init__(self, max_tables=8, window=5, min_bits=256, build_after=2, max_bytes=64 * 1024 * 1024):
+        self.max_tables = max_tables  # Largest number of tables kept, the least recently used is dropped first
+        self.max_bytes = max_bytes  # Largest estimated size of all tables, a group whose table alone is larger never gets one
+        self.window = window  # Window size of the built tables
+        self.min_bits = min_bits  # Smaller groups use pow directly, as it is already fast for them
+        self.build_after = build_after  # Number of uses of a group before its table is built
+
+        self.entries = OrderedDict()  # (g, p): use count, or a future of the table once it is being built
+        self.sizes = {}  # (g, p): estimated bytes of each built table
+        self.size = 0  # Estimated bytes of all built tables
+        self.lock = threading.Lock()
+
+    def table_size(self, p: int) -> int:
+        """
+        :return: Estimated bytes of the table for a prime, from its number of entries and the size of each integer
+        """
+        bits = p.bit_length()
+        return (bits + self.window - 1) // self.window * (1 << self.window) * (bits // 8 + 32)
+
+    def pow(self, g: int, exponent: int, p: int, trusted=False) -> int:
+        """
+        :param trusted: True if the group was not proposed by a remote user, only trusted groups get a table
+        :return: g^exponent mod p, using a precomputed table for frequently used groups
+        """
+        if p.bit_length() < self.min_bits:
+            return pow(g, exponent, p)
+
+        key = (g, p)
+        build = False
+        with self.lock:  # Only the lookup is done under the lock, never an exponentiation
+            entry = self.entries.get(key)
+            if isinstance(entry, Future):
+                self.entries.move_to_end(key)
+            elif trusted:  # Uses of other groups aren't counted, so remote users can't make us build tables or evict ours
+                entry = (entry or 0) + 1
+                if entry >= self.build_after and self.table_size(p) <= self.max_bytes:
+                    entry = Future()  # Other threads find the future, so the table is only built once
+                    build = True
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                self.evict()
+
+        if build:
+            try:
+                table = FixedBaseTable(g, p, self.window)  # Built outside the lock, so other groups are not blocked
+            except BaseException as e:
+                entry.set_exception(e)
+                with self.lock:
+                    if self.entries.get(key) is entry:
+                        del self.entries[key]
+                raise
+            entry.set_result(table)
+            with self.lock:
+                if self.entries.get(key) is entry:  # Not evicted while it was built
+                    self.sizes[key] = self.table_size(p)
+                    self.size += self.sizes[key]
+                    self.evict()
+            return table.pow(exponent)
+        if isinstance(entry, Future) and entry.done() and entry.exception() is None:
+            return entry.result().pow(exponent)
+        return pow(g, exponent, p)  # Not used often enough yet, or another thread is still building the table
+
+    def evict(self) -> None:
+        """
+        Drop the least recently used entries above the size limits
+        Must be called with the lock held
+        """
+        while len(self.entries) > self.max_tables or self.size > self.max_bytes:
+            key, _ = self.entries.popitem(last=False)
+            self.size -= self.sizes.pop(key, 0)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.size = 0
+
+
+CACHE = FixedBaseCache()  # Shared by all key calculations in the process
+
+
+def fixed_base_pow(g: int, exponent: int, p: int, trusted=False) -> int:
+    """
+    :param trusted: True if the group may get a table, see FixedBaseCache.pow
+    :return: g^exponent mod p, using the shared table cache
+    """
+    return CACHE.pow(g, exponent, p, trusted)
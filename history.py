@@ -0,0 +1,30 @@
+SENT = 0  # Message sent by us
+RECEIVED = 1  # Message received from the remote user
+INVALID = 2  # Received message that could not be decrypted
+
+
+class MessageHistory:
+    """
+    Every message of a conversation, stored as a kind byte and the text
+    """
+
+    def __init__(self):
+        self.kinds = bytearray()  # SENT, RECEIVED or INVALID for each message
+        self.texts = []  # Text of each message, empty for invalid messages
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, index: int) -> tuple[int, str]:
+        """
+        :return: The kind and text of a message
+        """
+        return self.kinds[index], self.texts[index]
+
+    def append(self, kind: int, text: str) -> None:
+        self.kinds.append(kind)
+        self.texts.append(text)
+
+    def clear(self) -> None:
+        self.kinds.clear()
+        self.texts.clear()
@@ -0,0 +1,140 @@
+"""
+Key agreement backends, chosen with the 'kex' of the shared parameters
+
+Every backend works on integers, so secrets, public keys and shared secrets are stored, displayed and sent the same way for all of them.
+Elliptic curve public keys are the integer value of their compact encoding: a compressed SEC1 point for P-256, and the 32-byte
+u-coordinate for X25519.
+"""
+from fixedbase import fixed_base_pow
+
+from Crypto.PublicKey import ECC
+from abc import ABC, abstractmethod
+import secrets
+
+try:  # Curve25519 key agreement needs a recent pycryptodome
+    from Crypto.Protocol.DH import import_x25519_public_key, key_agreement
+except ImportError:
+    key_agreement = None
+
+
+class KeyAgreement(ABC):
+    """
+    A way of agreeing on a shared secret from a secret key and a remote public key
+    """
+    name = ""
+
+    @property
+    def group(self) -> tuple:
+        """
+        :return: Key identifying the group, key pairs can only be used within the same group
+        """
+        return (self.name,)
+
+    @abstractmethod
+    def random_secret(self) -> int:
+        """
+        :return: A new random secret key
+        """
+
+    @abstractmethod
+    def public_key(self, secret: int) -> int:
+        """
+        :return: The public key of a secret key
+        """
+
+    @abstractmethod
+    def shared_secret(self, secret: int, remote_public: int) -> int:
+        """
+        :return: The shared secret of our secret key and the remote public key
+        :raises ValueError: If the remote public key is not valid
+        """
+
+
+class ModP(KeyAgreement):
+    """
+    Finite field Diffie-Hellman with a generator g modulo a prime p
+    """
+    name = "modp"
+
+    def __init__(self, g: int, p: int, trusted=False):
+        self.g = g
+        self.p = p
+        self.trusted = trusted  # True if the group wasn't proposed by a remote user, only then are powers of g precomputed
+
+    @property
+    def group(self) -> tuple:
+        return self.name, self.g, self.p
+
+    def random_secret(self) -> int:
+        return secrets.randbelow(self.p - 3) + 2
+
+    def public_key(self, secret: int) -> int:
+        return fixed_base_pow(self.g, secret, self.p, self.trusted)  # g and p rarely change, so powers of g are precomputed
+
+    def shared_secret(self, secret: int, remote_public: int) -> int:
+        if not 2 <= remote_public <= self.p - 2:  # 0, 1 and p - 1 would force a known shared secret
+            raise ValueError("Public key is out of range")
+        return pow(remote_public, secret, self.p)
+
+
+class P256(KeyAgreement):
+    """
+    Elliptic curve Diffie-Hellman on NIST P-256, the shared secret is the x-coordinate of the shared point
+    """
+    name = "p256"
+    SIZE = 32  # Bytes of a coordinate
+    ORDER = 0xFFFFFFFF00000000FFFFFFFFFFFFFFFFBCE6FAADA7179E84F3B9CAC2FC632551  # Order of the base point
+
+    def random_secret(self) -> int:
+        return secrets.randbelow(self.ORDER - 1) + 1
+
+    def public_key(self, secret: int) -> int:
+        point = ECC.construct(curve="p256", d=secret).pointQ
+        return int.from_bytes(bytes((2 + (int(point.y) & 1),)) + int(point.x).to_bytes(self.SIZE, "big"), "big")  # Compressed point
+
+    def shared_secret(self, secret: int, remote_public: int) -> int:
+        encoded = remote_public.to_bytes(self.SIZE + 1, "big")
+        if encoded[0] not in (2, 3):
+            raise ValueError("Public key is not a compressed point")
+        point = ECC.import_key(encoded, curve_name="p256").pointQ  # Checks that the point is on the curve
+        return int((point * secret).x)
+
+
+class X25519(KeyAgreement):
+    """
+    Elliptic curve Diffie-Hellman on Curve25519, as in RFC 7748
+    """
+    name = "x25519"
+    SIZE = 32  # Bytes of a key
+
+    def random_secret(self) -> int:
+        return int.from_bytes(secrets.token_bytes(self.SIZE), "big")
+
+    def private_key(self, secret: int):
+        return ECC.construct(curve="curve25519", seed=secret.to_bytes(self.SIZE, "big"))
+
+    def public_key(self, secret: int) -> int:
+        return int.from_bytes(self.private_key(secret).public_key().export_key(format="raw"), "big")
+
+    def shared_secret(self, secret: int, remote_public: int) -> int:
+        remote_key = import_x25519_public_key(remote_public.to_bytes(self.SIZE, "big"))  # Rejects low order points
+        return int.from_bytes(key_agreement(static_priv=self.private_key(secret), static_pub=remote_key, kdf=lambda z: z), "big")
+
+
+CURVES = {backend.name: backend for backend in (P256(), X25519() if key_agreement is not None else None) if backend is not None}
+KEX = ["modp", *CURVES]  # Supported key agreements, mod-p is used by users that don't negotiate one
+
+
+def get_backend(kex: str, g=-1, p=-1, trusted=False) -> KeyAgreement:
+    """
+    :param kex: Name of the key agreement
+    :param g: Generator, only used by mod-p
+    :param p: Prime, only used by mod-p
+    :param trusted: True if the mod-p group wasn't proposed by a remote user
+    :return: The backend for the key agreement
+    """
+    if kex == "modp":
+        return ModP(g, p, trusted)
+    if kex in CURVES:
+        return CURVES[kex]
+    raise ValueError(f"Unsupported key agreement {kex}, expected one of {', '.join(KEX)}")
@@ -0,0 +1,127 @@
+"""
+Pool of precomputed key pairs, so a handshake takes a ready public key instead of waiting on a key calculation
+
+Only trusted groups are pooled: curves, the standard mod-p groups and groups picked by the local user. Any remote user can propose a
+group, and complete an exchange in it, so pooling their groups would let them make us calculate key pairs for groups never used again.
+"""
+import compute
+from groups import STANDARD_GROUPS
+from keyagreement import KeyAgreement, get_backend
+import metrics
+
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+
+class KeyPool:
+    """
+    Key pairs for each recently used group, refilled in the background
+    Each pair is handed out once, so every handshake still gets a fresh key pair
+    """
+
+    STANDARD = {("modp", g, p) for g, p in STANDARD_GROUPS.values()}
+
+    def __init__(self, size=8, workers=1, max_groups=4, compute=compute.INLINE, max_chosen=16):
+        self.size = size  # Number of ready pairs kept for each group
+        self.max_groups = max_groups  # Number of groups kept, the least recently used is dropped first
+        self.max_chosen = max_chosen  # Number of remembered groups picked by the local user
+        self.chosen_groups = OrderedDict()  # Groups picked by the local user, trusted for pooling, from least to most recent
+        self.closed = False
+        self.pools = OrderedDict()  # Group: deque of (secret, public), ordered from least to most recently used
+        self.pending = {}  # Group: number of pairs being calculated
+        self.compute = compute  # Runs the key calculations, in worker processes if it is a ComputeExecutor
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dh-keypool")  # Refills the pools
+
+    def prepare(self, agreement: KeyAgreement) -> None:
+        """
+        Start filling the pool of a trusted group, before its handshake
+        """
+        with self.lock:
+            if self._trusted(agreement.group):
+                self._refill(agreement)
+
+    def take(self, agreement: KeyAgreement) -> tuple[int, int]:
+        """
+        Take a key pair, calculating one right away if none is ready
+        :return: The secret and public key
+        """
+        with self.lock:
+            pool = self.pools.get(agreement.group)
+            pair = pool.popleft() if pool else None
+            if self._trusted(agreement.group):
+                self._refill(agreement)
+        metrics.KEYPOOL_TAKES.inc(agreement.name, "ready" if pair is not None else "empty")
+        if pair is None:
+            pair = self.compute.run(compute.keypair, agreement)
+        return pair
+
+    def choose(self, agreement: KeyAgreement) -> None:
+        """
+        Trust a group picked by the local user, so exchanges in it are pooled
+        Never called for groups proposed by remote users, however many exchanges they complete in them
+        """
+        with self.lock:
+            self.chosen_groups[agreement.group] = True
+            self.chosen_groups.move_to_end(agreement.group)
+            while len(self.chosen_groups) > self.max_chosen:
+                self.chosen_groups.popitem(last=False)
+
+    def agreement(self, kex: str, g=-1, p=-1) -> KeyAgreement:
+        """
+        :return: Backend for the key agreement, marked as trusted if its group is, so only trusted groups get fixed-base tables
+        """
+        with self.lock:
+            trusted = kex != "modp" or self._trusted(("modp", g, p))
+        return get_backend(kex, g, p, trusted)
+
+    def trusted(self, group: tuple) -> bool:
+        """
+        :return: True if key pairs of the group may be calculated ahead of time
+        """
+        with self.lock:
+            return self._trusted(group)
+
+    def _trusted(self, group: tuple) -> bool:
+        """
+        Must be called with the lock held
+        """
+        return group[0] != "modp" or group in self.STANDARD or group in self.chosen_groups
+
+    def _refill(self, agreement: KeyAgreement) -> None:
+        """
+        Queue calculations for the pairs missing from a pool
+        Must be called with the lock held
+        """
+        if self.closed:
+            return
+        group = agreement.group
+        pool = self.pools.get(group)
+        if pool is None:
+            pool = self.pools[group] = deque()
+            while len(self.pools) > self.max_groups:
+                dropped, _ = self.pools.popitem(last=False)
+                self.pending.pop(dropped, None)
+        self.pools.move_to_end(group)
+        for _ in range(self.size - len(pool) - self.pending.get(group, 0)):
+            self.pending[group] = self.pending.get(group, 0) + 1
+            self.executor.submit(self._generate, agreement)
+
+    def _generate(self, agreement: KeyAgreement) -> None:
+        group = agreement.group
+        pair = None
+        try:
+            pair = self.compute.run(compute.keypair, agreement)
+        finally:
+            with self.lock:
+                if group in self.pending:
+                    self.pending[group] = max(0, self.pending[group] - 1)
+                pool = self.pools.get(group)
+                if pair is not None and pool is not None and len(pool) < self.size:  # The group may have been dropped meanwhile
+                    pool.append(pair)
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,227 @@
+from DH import DiffieHellman
+from encryption import MODES
+from groups import get_group
+from keyagreement import KEX
+
+from collections import Counter
+from contextlib import redirect_stderr, redirect_stdout
+import argparse
+import json
+import os
+import secrets
+import statistics
+import threading
+import time
+
+PHASES = ["keygen", "handshake", "shared", "public", "set_state", "message"]  # Steps of each exchange
+
+
+class Peer(DiffieHellman):
+    """
+    Headless user that runs exchanges against the target server, remembering the last response to tell errors apart
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_response = None  # Response to the last sent request, None if the connection failed
+
+    def post(self, data: dict) -> dict | None:
+        self.last_response = super().post(data)
+        return self.last_response
+
+
+class LoadGenerator:
+    def __init__(self, remote_ip: str, remote_port: int, g: int, p: int, peers=100, concurrency=8, rate=0.0, messages=1,
+                 message_size=64, wire_format="json", cipher_mode="eax", timeout=5.0, kex="modp", handshake=False):
+        self.remote_ip = remote_ip  # Address of the server under test
+        self.remote_port = remote_port
+        self.g = g  # Shared parameters of every exchange, only used by mod-p
+        self.p = p
+        self.kex = kex  # Key agreement of every exchange
+        self.handshake = handshake  # Exchange keys with one combined request, instead of shared, public and set_state
+        self.peers = peers  # Number of exchanges to run, each with its own session ID and key pair
+        self.concurrency = concurrency  # Number of exchanges running at once, each on its own kept alive connection
+        self.rate = rate  # Exchanges started per second, 0 starts each one as soon as a connection is free
+        self.messages = messages  # Messages sent in each exchange, after the key exchange
+        self.message = "x" * message_size
+        self.wire_format = wire_format
+        self.cipher_mode = cipher_mode
+        self.timeout = timeout
+
+        self.lock = threading.Lock()
+        self.next_peer = 0  # Index of the next exchange to start
+        self.latencies = {phase: [] for phase in PHASES + ["exchange"]}  # Seconds of each successful step
+        self.errors = Counter()  # 'phase: reason': count
+        self.completed = 0  # Exchanges where every step succeeded
+        self.start = 0.0
+
+    def run(self) -> dict:
+        """
+        Run every exchange, then summarize the results
+        """
+        self.start = time.perf_counter()
+        threads = [threading.Thread(target=self.worker, name=f"loadgen-{i}") for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - self.start)
+
+    def worker(self) -> None:
+        peer = Peer(name="loadgen", remote_ip=self.remote_ip, remote_port=self.remote_port, g=self.g, p=self.p, wire_format=self.wire_format,
+                    cipher_mode=self.cipher_mode, timeout=self.timeout, retries=0, kex=self.kex)  # Retries would hide the errors we want to count
+        try:
+            while True:
+                with self.lock:
+                    index = self.next_peer
+                    if index >= self.peers:
+                        return
+                    self.next_peer += 1
+                scheduled = self.start + index / self.rate if self.rate else time.perf_counter()
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self.exchange(peer, index, scheduled)
+        finally:
+            peer.stop()
+
+    def exchange(self, peer: Peer, index: int, scheduled: float) -> None:
+        """
+        Run one exchange, from the shared parameters to the messages
+        :param scheduled: Time the exchange should have started, so time spent waiting for a connection counts as latency
+        """
+        peer.session_id = f"loadgen-{index}-{secrets.token_hex(4)}"
+        peer.public = peer.remote_public = peer.shared_secret = -1
+        steps = [("keygen", self.keygen)]
+        if self.handshake:
+            steps.append(("handshake", lambda p: p.send_request("handshake")))
+        else:
+            steps += [
+                ("shared", lambda p: p.send_request("shared")),
+                ("public", lambda p: p.send_request("public")),
+                ("set_state", lambda p: p.send_request("start_chat")),
+            ]
+        steps += [("message", lambda p: p.send_message(self.message))] * self.messages
+
+        times = []
+        for phase, step in steps:
+            peer.last_response = {}
+            start = time.perf_counter()
+            try:
+                success = step(peer)
+            except Exception as e:
+                self.fail(phase, type(e).__name__)
+                return
+            if not success:
+                if peer.last_response is None:
+                    reason = "connection failed"
+                else:
+                    reason = peer.last_response.get("error", "rejected")
+                self.fail(phase, reason)
+                return
+            times.append((phase, time.perf_counter() - start))
+
+        with self.lock:
+            for phase, seconds in times:
+                self.latencies[phase].append(seconds)
+            self.latencies["exchange"].append(time.perf_counter() - scheduled)
+            self.completed += 1
+
+    @staticmethod
+    def keygen(peer: Peer) -> bool:
+        peer.secret = peer.key_agreement.random_secret()
+        peer.calculate_public_key()
+        return True
+
+    def fail(self, phase: str, reason: str) -> None:
+        with self.lock:
+            self.errors[f"{phase}: {reason}"] += 1
+
+    def report(self, elapsed: float) -> dict:
+        """
+        :return: Throughput, latency percentiles in milliseconds for each step, and the count of each error
+        """
+        requests = sum(len(self.latencies[phase]) for phase in PHASES if phase != "keygen")
+        return {
+            "peers": self.peers,
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "kex": self.kex,
+            "bits": self.p.bit_length() if self.kex == "modp" else None,
+            "elapsed_sec": elapsed,
+            "completed": self.completed,
+            "failed": sum(self.errors.values()),
+            "exchanges_per_sec": self.completed / elapsed if elapsed else 0.0,
+            "requests_per_sec": requests / elapsed if elapsed else 0.0,
+            "latency_ms": {phase: percentiles(times) for phase, times in self.latencies.items() if times},
+            "errors": dict(self.errors.most_common()),
+        }
+
+
+def percentiles(times: list[float]) -> dict:
+    times = sorted(times)
+
+    def at(q: float) -> float:
+        return times[min(len(times) - 1, int(len(times) * q))] * 1e3
+
+    return {"count": len(times), "mean": statistics.fmean(times) * 1e3, "p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": times[-1] * 1e3}
+
+
+def print_report(report: dict) -> None:
+    group = f"{report['bits']}-bit group" if report["kex"] == "modp" else report["kex"]
+    print(f"{report['completed']}/{report['peers']} exchanges in {report['elapsed_sec']:.2f} s, concurrency {report['concurrency']}, {group}")
+    print(f"{report['exchanges_per_sec']:.1f} exchanges/s, {report['requests_per_sec']:.1f} requests/s")
+    print(f"{'step':<10}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)")
+    for phase, stats in report["latency_ms"].items():
+        print(f"{phase:<10}{stats['count']:>8}" + "".join(f"{stats[key]:>10.2f}" for key in ("mean", "p50", "p90", "p99", "max")))
+    for error, count in report["errors"].items():
+        print(f"error {error}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many concurrent key exchanges against a server and report its throughput and latency")
+    parser.add_argument("remote_ip", nargs="?", default="127.0.0.1", help="IP of the server under test")
+    parser.add_argument("--remote-port", type=int, default=8080, help="Port of the server under test")
+    parser.add_argument("--spawn", action="store_true", help="Start a server in this process and test it, instead of a remote server")
+    parser.add_argument("--server-workers", type=int, help="Request handling threads of the spawned server, defaults to 8")
+    parser.add_argument("--compute-workers", type=int, default=0, help="Key calculation processes of the spawned server, 0 for none")
+    parser.add_argument("-n", "--peers", type=int, default=200, help="Number of exchanges, each with its own session and key pair")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Number of exchanges running at once")
+    parser.add_argument("--rate", type=float, default=0.0, help="Exchanges started per second, 0 for as fast as possible")
+    parser.add_argument("--handshake", action="store_true", help="Exchange keys with one combined request instead of three")
+    parser.add_argument("--messages", type=int, default=1, help="Messages sent in each exchange")
+    parser.add_argument("--message-size", type=int, default=64, help="Characters in each message")
+    parser.add_argument("--kex", choices=KEX, default="modp", help="Key agreement, mod-p or an elliptic curve")
+    parser.add_argument("--group", default="modp2048", help="Standard group name or prime size in bits, for mod-p")
+    parser.add_argument("--wire-format", choices=["json", "binary"], default="json", help="Format of sent requests")
+    parser.add_argument("--cipher", choices=MODES, default="eax", help="AEAD mode of the exchanges")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Seconds to wait for each response")
+    parser.add_argument("-o", "--output", help="File to write the JSON report to")
+    args = parser.parse_args()
+
+    g, p = get_group(args.group) if args.kex == "modp" else (-1, -1)
+    server = None
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull), redirect_stderr(devnull):  # Keep request logging out of the report
+        if args.spawn:
+            server = DiffieHellman(port=0, name="server", workers=args.server_workers or 8, max_sessions=max(10000, args.peers),
+                                   compute_workers=args.compute_workers)
+            server.start()
+            args.remote_ip, args.remote_port = "127.0.0.1", server.httpd.server_address[1]
+        try:
+            generator = LoadGenerator(args.remote_ip, args.remote_port, g, p, peers=args.peers, concurrency=args.concurrency, rate=args.rate,
+                                      messages=args.messages, message_size=args.message_size, wire_format=args.wire_format,
+                                      cipher_mode=args.cipher, timeout=args.timeout, kex=args.kex,
+                                      handshake=args.handshake)
+            report = generator.run()
+        finally:
+            if server is not None:
+                server.stop()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
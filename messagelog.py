@@ -0,0 +1,155 @@
+"""
+Append-only, encrypted on-disk message log with a sidecar offset index
+
+The log file holds one record per message:
+    record length (4 bytes) | kind (1 byte) | nonce length (1 byte) | nonce | tag (16 bytes) | ciphertext
+The index file holds the offset of each record as 8 bytes, so message i is found in O(1) without reading the log.
+Both files are memory-mapped for reading, and only the messages that are read get decrypted.
+Records are flushed but not synced to disk, so the last messages can be lost if the machine crashes. A record that was only partly
+written is dropped when the log is opened.
+"""
+from encryption import Encryption
+from history import INVALID
+
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+import mmap
+import os
+import struct
+
+TAG_SIZE = 16
+
+_RECORD = struct.Struct(">IBB")  # Record length, kind and nonce length
+_OFFSET = struct.Struct(">Q")
+
+
+def log_key(shared_secret: int) -> bytes:
+    """
+    Derive the log key of a conversation from the shared key of its first exchange, resumed exchanges carry it over in their tickets
+    The log never shares a key or nonces with the messages on the wire
+    :return: The log key
+    """
+    secret = shared_secret.to_bytes((shared_secret.bit_length() + 7) // 8 or 1, "big")
+    return HKDF(secret, 32, b"", SHA256, context=b"DH_Demo message log")
+
+
+class MessageLog:
+    """
+    Messages of a conversation, stored on disk encrypted under the shared key
+    Has the same interface as MessageHistory, so the message view can show either
+    """
+
+    def __init__(self, path: str, cipher: Encryption):
+        self.path = path  # Path of the log, the index is stored next to it with an .idx suffix
+        self.cipher = cipher  # Encryption for the stored messages
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.log = open(path, "ab")
+        self.index = open(path + ".idx", "ab")
+        self.count = os.path.getsize(path + ".idx") // _OFFSET.size  # Number of messages, a partly written offset is ignored
+        self.size = self._end_of_indexed()  # Size of the log, a record whose offset was never written is dropped
+        self.index.truncate(self.count * _OFFSET.size)
+        self.log.truncate(self.size)
+        self.log_map = self.index_map = None  # Maps of the files, remapped when they have grown
+        self.index_size = 0  # Size of the index when it was mapped
+
+    @classmethod
+    def for_key(cls, directory: str, key: bytes, mode="gcm") -> "MessageLog":
+        """
+        Open the log of a conversation, the same log key brings back the same history
+        :param directory: Directory of the logs
+        :param key: Log key of the conversation, from log_key()
+        :param mode: AEAD mode the messages are stored with
+        """
+        cipher = Encryption(int.from_bytes(key, "big"), mode)
+        name = SHA256.new(b"message log" + key).hexdigest()[:32]  # Names the log without revealing the key
+        return cls(os.path.join(directory, f"{name}.log"), cipher)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> tuple[int, str]:
+        """
+        :return: The kind and text of a message, or INVALID if it could not be decrypted
+        """
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("Message index out of range")
+        self._map()
+        (offset,) = _OFFSET.unpack_from(self.index_map, index * _OFFSET.size)
+        length, kind, nonce_length = _RECORD.unpack_from(self.log_map, offset)
+        record = memoryview(self.log_map)[offset + _RECORD.size:offset + 4 + length]
+        nonce, tag, ct = record[:nonce_length], record[nonce_length:nonce_length + TAG_SIZE], record[nonce_length + TAG_SIZE:]
+
+        text = self.cipher.decrypt_bytes(ct, tag, nonce, header=bytes((kind,)))  # The kind is authenticated with the text
+        if text is False:
+            return INVALID, ""
+        return kind, text.decode("utf-8")
+
+    def append(self, kind: int, text: str) -> None:
+        """
+        Encrypt a message and add it to the end of the log
+        """
+        ct, tag, nonce = self.cipher.encrypt_bytes(text.encode("utf-8"), header=bytes((kind,)))
+        record = _RECORD.pack(2 + len(nonce) + TAG_SIZE + len(ct), kind, len(nonce)) + nonce + tag + ct
+        self.log.write(record)
+        self.log.flush()
+        self.index.write(_OFFSET.pack(self.size))  # Written after the record, so the index never points past the log
+        self.index.flush()
+        self.size += len(record)
+        self.count += 1
+
+    def search(self, query: str, start=0):
+        """
+        Find the messages containing a string
+        :param query: String to search for
+        :param start: Index of the first message to search
+        :return: Generator of the indices of matching messages
+        """
+        for index in range(start, self.count):
+            if query in self[index][1]:
+                yield index
+
+    def close(self) -> None:
+        for m in (self.log_map, self.index_map):
+            if m is not None:
+                m.close()
+        self.log.close()
+        self.index.close()
+
+    def _map(self) -> None:
+        """
+        Map the files again if messages have been appended since they were mapped
+        """
+        if self.index_map is not None and self.index_size >= self.count * _OFFSET.size:
+            return
+        self.log.flush()
+        self.index.flush()
+        for m in (self.log_map, self.index_map):
+            if m is not None:
+                m.close()
+        with open(self.path, "rb") as f:
+            self.log_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.path + ".idx", "rb") as f:
+            self.index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index_size = len(self.index_map)
+
+    def _end_of_indexed(self) -> int:
+        """
+        Offsets of records that were cut short, by a crash while writing, are dropped from the count
+        :return: Offset just past the last complete indexed record
+        """
+        log_size = os.path.getsize(self.path)
+        with open(self.path + ".idx", "rb") as index, open(self.path, "rb") as log:
+            while self.count > 0:
+                index.seek((self.count - 1) * _OFFSET.size)
+                (offset,) = _OFFSET.unpack(index.read(_OFFSET.size))
+                log.seek(offset)
+                header = log.read(4)
+                if len(header) == 4:
+                    (length,) = struct.unpack(">I", header)
+                    if offset + 4 + length <= log_size:
+                        return offset + 4 + length
+                self.count -= 1
+        return 0
@@ -0,0 +1,138 @@
+"""
+In-process counters and latency histograms, rendered in the Prometheus text format
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(names: tuple, values: tuple, extra="") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Counts of events, for each combination of label values
+    """
+
+    def __init__(self, name: str, description: str, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.values = {}  # Label values: count
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of durations in fixed buckets, for each combination of label values
+    """
+
+    def __init__(self, name: str, description: str, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # Label values: [count in each bucket, then above the last bucket], sum
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Observe the duration of the with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    bucket = _labels(self.label_names, labels, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, description: str, labels=()) -> Counter:
+        metric = Counter(name, description, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, labels=(), buckets=BUCKETS) -> Histogram:
+        metric = Histogram(name, description, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        :return: Every metric in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_TYPES = {"shared", "public", "set_state", "message", "message_batch", "stream", "handshake", "resume"}  # Other types are counted as 'other'
+
+REQUESTS = REGISTRY.counter("dh_requests_total", "Received requests", ["type"])
+REQUEST_ERRORS = REGISTRY.counter("dh_request_errors_total", "Received requests that were not successful", ["type"])
+REQUEST_SECONDS = REGISTRY.histogram("dh_request_seconds", "Time to handle a received request", ["type"])
+SENDS = REGISTRY.counter("dh_sends_total", "Sent requests", ["type"])
+SEND_ERRORS = REGISTRY.counter("dh_send_errors_total", "Sent requests that failed or were not successful", ["type"])
+SEND_SECONDS = REGISTRY.histogram("dh_send_seconds", "Round trip time of a sent request, including retries", ["type"])
+KEX_SECONDS = REGISTRY.histogram("dh_key_agreement_seconds", "Time to calculate a public key or shared secret", ["operation", "kex"])
+KEYPOOL_TAKES = REGISTRY.counter("dh_keypool_takes_total", "Key pairs taken from the pool, 'empty' when one had to be calculated", ["kex", "result"])
+CIPHER_SECONDS = REGISTRY.histogram("dh_cipher_seconds", "Time to encrypt or decrypt a message", ["operation", "mode"])
+CIPHER_BYTES = REGISTRY.counter("dh_cipher_bytes_total", "Bytes encrypted or decrypted", ["operation", "mode"])
+COMPUTE_SECONDS = REGISTRY.histogram("dh_compute_seconds", "Time from handing work to the compute processes to its result", ["operation"])
+CHANNEL_FRAMES = REGISTRY.counter("dh_channel_frames_total", "Frames sent or received on open channels", ["direction"])
+
+
+def request_type(data: dict) -> str:
+    """
+    :return: The type of a request, limited to the known types so labels stay few
+    """
+    value = data.get("type") if isinstance(data, dict) else None
+    return value if value in REQUEST_TYPES else "other"
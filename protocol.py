@@ -0,0 +1,114 @@
+"""
+Checks of the requests of the exchange, shared by the single remote user in DH.py and the session table in sessions.py
+
+Each check fills in the error of the response and returns None when a request can't be accepted, so both answer a request the same way.
+"""
+import compute
+from encryption import Encryption, MODES
+from keyagreement import KEX
+import wire
+
+MAX_GROUP_BITS = 8192  # Largest accepted prime, larger groups cost too much to calculate with
+REQUEST_TYPES = ["shared", "handshake", "public", "set_state", "message", "message_batch", "resume"]
+STATES = ["select_user", "pick_shared", "pick_secret", "awaiting_public", "show_keys", "messaging"]  # States of the control panel
+
+
+def negotiate(data: dict, response: dict) -> tuple[str, str] | None:
+    """
+    Check the key agreement, shared parameters and AEAD mode proposed by the remote user
+    :param data: The request data
+    :param response: The response, the error is set on it if the proposal can't be accepted
+    :return: The key agreement and AEAD mode, or None if the proposal can't be accepted
+    """
+    kex = data.get("kex", "modp")  # Peers that don't negotiate the key agreement use mod-p
+    if kex not in KEX:
+        response["error"] = f"Unsupported key agreement {kex}"
+        return None
+    if kex == "modp" and ("g" not in data or "p" not in data):
+        response["error"] = "Missing parameters"
+        return None
+    if kex == "modp" and (not isinstance(data["g"], int) or not isinstance(data["p"], int) or data["p"] < 5):
+        response["error"] = "Invalid parameters"
+        return None
+    if kex == "modp" and data["p"].bit_length() > MAX_GROUP_BITS:  # Checked before any work is done for the group
+        response["error"] = f"Group too large, at most {MAX_GROUP_BITS} bits"
+        return None
+    mode = data.get("mode", "eax")  # Peers that don't negotiate the mode use EAX
+    if mode not in MODES:
+        response["error"] = f"Unsupported cipher mode {mode}"
+        return None
+    response["kex"] = kex
+    response["mode"] = mode
+    return kex, mode
+
+
+def valid_state(value: str | int) -> bool:
+    """
+    :return: True if the value is a state of the control panel, by name or by index
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return 0 <= value < len(STATES)
+    return value in STATES
+
+
+def check_state(data: dict, response: dict) -> str | int | None:
+    """
+    Check a 'set_state' request
+    :return: The requested state, or None if it is missing or not a state
+    """
+    if "state" not in data:
+        response["error"] = "Missing parameters"
+        return None
+    if not valid_state(data["state"]):
+        response["error"] = "Invalid state"
+        return None
+    return data["state"]
+
+
+def check_messages(data: dict, response: dict) -> tuple[list[dict], int | None] | None:
+    """
+    Check a 'message' or 'message_batch' request
+    :return: The encrypted messages and the sequence number of the first one if it was sent, or None if the request is malformed
+    """
+    if data["type"] == "message_batch":
+        if "messages" not in data:
+            response["error"] = "Missing parameters"
+            return None
+        msgs = data["messages"]
+    else:
+        msgs = [data]
+    if not isinstance(msgs, list) or not all(isinstance(msg, dict) for msg in msgs):
+        response["error"] = "Invalid parameters"
+        return None
+    for msg in msgs:
+        if "message" not in msg or "tag" not in msg or "nonce" not in msg:  # Check if all parameters are present
+            response["error"] = "Missing parameters"
+            return None
+    seq = data.get("seq")
+    if seq is not None and (not isinstance(seq, int) or isinstance(seq, bool) or seq < 0):
+        response["error"] = "Invalid parameters"
+        return None
+    return msgs, seq
+
+
+def invalid_type(response: dict) -> dict:
+    """
+    Answer a request of an unknown type, clients that get this fall back to the requests of older versions
+    :return: The response
+    """
+    expected = ", ".join(f"'{request_type}'" for request_type in REQUEST_TYPES[:-1])
+    response["error"] = f"Invalid request type, expected {expected} or '{REQUEST_TYPES[-1]}'"
+    return response
+
+
+def decrypt(cipher: Encryption, data: dict, compute=compute.INLINE) -> str | bool:
+    """
+    Decrypt a received message, sent as either hex in JSON or raw bytes in a frame
+    :param data: Dict with the message, tag and nonce
+    :param compute: Executor that decrypts large messages
+    :return: The decrypted message, or False if the decryption failed
+    """
+    msg = compute.run_cipher(cipher.decrypt_bytes, wire.as_bytes(data["message"]), wire.as_bytes(data["tag"]), wire.as_bytes(data["nonce"]))
+    if msg is False:
+        return False
+    return msg.decode("utf-8")
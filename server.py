@@ -0,0 +1,230 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import selectors
+import socket
+import threading
+import time
+
+IDLE_TIMEOUT = 60.0  # Seconds a kept alive connection may wait for its next request before it is closed
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """
+    Handler of HTTP/1.1 connections that are kept open between requests
+    On a server that watches idle connections, the handler returns after each request and the server waits for the next one, so an
+    idle connection never holds a worker. On other servers the handler waits for the next request itself
+    """
+    protocol_version = "HTTP/1.1"
+    idle = False  # True when the handler returned to wait for the next request on its connection
+
+    def handle(self) -> None:
+        self.idle = False
+        self.handle_one_request()
+        while not self.close_connection:
+            if getattr(self.server, "watches_idle", False) and not self.buffered():
+                self.idle = True
+                return
+            self.handle_one_request()
+
+    def buffered(self) -> bool:
+        """
+        :return: True if data of the next request has already been received, pipelined behind the last request
+        """
+        self.connection.setblocking(False)  # Only look at what has arrived, never wait for more
+        try:
+            return len(self.rfile.peek(1)) > 0
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def resume(self) -> None:
+        """
+        Handle the next request of an idle connection, called by the server once data of the request has arrived
+        """
+        try:
+            self.handle()
+        finally:
+            self.finish()
+
+    def finish(self) -> None:
+        if not self.idle:  # The files of an idle connection are used again for its next request
+            super().finish()
+
+
+class DetachingHTTPServer(HTTPServer):
+    """
+    HTTP server whose handlers can take over their connection, to keep using it after the handler returns
+    """
+
+    def __init__(self, server_address, handler_class):
+        super().__init__(server_address, handler_class)
+        self.detached = set()  # Connections taken over by a handler, not closed when the handler returns
+        self.detached_lock = threading.Lock()
+
+    def detach(self, request) -> None:
+        """
+        Keep a connection open after its handler returns, its new owner closes it
+        """
+        with self.detached_lock:
+            self.detached.add(request)
+
+    def shutdown_request(self, request) -> None:
+        with self.detached_lock:
+            if request in self.detached:
+                self.detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+
+class PooledHTTPServer(DetachingHTTPServer):
+    """
+    HTTP server that handles requests on a bounded pool of worker threads
+    Kept alive connections only hold a worker while a request is handled. In between they are watched by a single thread, and handed
+    back to the pool once their next request arrives
+    """
+    watches_idle = True  # Handlers return idle connections to the server, instead of waiting on them
+
+    def __init__(self, server_address, handler_class, workers=8, backlog=None, idle_timeout=IDLE_TIMEOUT):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.idle_timeout = idle_timeout  # Seconds an idle connection is kept open
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dh-worker")  # Workers handling the requests
+        # Limit accepted but unhandled requests, so a flood blocks the accept loop instead of growing the queue forever
+        self.slots = threading.BoundedSemaphore(backlog or workers * 4)
+
+        self.parked = []  # Handlers that became idle, registered with the selector by the watching thread
+        self.idle_lock = threading.Lock()
+        self.closed = False
+        self.selector = selectors.DefaultSelector()  # Idle connections, only used by the watching thread
+        self.wakeup, self.wakeup_sender = socket.socketpair()  # Wakes up the watching thread when a connection is parked
+        self.wakeup_sender.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.idle_thread = threading.Thread(target=self.watch_idle, name="dh-idle", daemon=True)
+        self.idle_thread.start()
+
+    def process_request(self, request, client_address) -> None:
+        """
+        Hand an accepted connection to the worker pool
+        """
+        self.dispatch(self.process_request_thread, request, client_address)
+
+    def dispatch(self, fn, request, *args) -> None:
+        self.slots.acquire()
+        try:
+            self.pool.submit(fn, request, *args)
+        except RuntimeError:  # The pool has been shut down
+            self.slots.release()
+            self.shutdown_request(request)
+
+    def finish_request(self, request, client_address) -> KeepAliveHandler:
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def process_request_thread(self, request, client_address) -> None:
+        """
+        Function to handle the first request of a connection in a worker thread
+        """
+        handler = None
+        try:
+            handler = self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.release(request, handler)
+
+    def process_idle_thread(self, request, handler: KeepAliveHandler) -> None:
+        """
+        Function to handle the next request of an idle connection in a worker thread
+        """
+        try:
+            handler.resume()
+        except Exception:
+            self.handle_error(request, handler.client_address)
+        finally:
+            self.release(request, handler)
+
+    def release(self, request, handler: KeepAliveHandler | None) -> None:
+        """
+        Free the worker of a handled request, parking the connection if it is kept alive
+        """
+        if handler is not None and getattr(handler, "idle", False):
+            self.park(handler)
+        else:
+            self.shutdown_request(request)
+        self.slots.release()
+
+    def park(self, handler: KeepAliveHandler) -> None:
+        """
+        Let the watching thread wait for the next request of an idle connection
+        """
+        with self.idle_lock:
+            if not self.closed:
+                self.parked.append(handler)
+                handler = None
+        if handler is not None:
+            self.close_idle(handler)
+            return
+        try:
+            self.wakeup_sender.send(b"\0")
+        except OSError:  # Already woken up by earlier parked connections, or the server was closed meanwhile
+            pass
+
+    def close_idle(self, handler: KeepAliveHandler) -> None:
+        handler.idle = False
+        handler.finish()
+        self.shutdown_request(handler.connection)
+
+    def watch_idle(self) -> None:
+        """
+        Wait for the next request on every idle connection, and hand each connection to the pool once data has arrived
+        Connections idle for longer than idle_timeout are closed
+        """
+        idle = {}  # Connection: (handler, time it became idle), from the longest idle
+        while True:
+            with self.idle_lock:
+                parked, self.parked = self.parked, []
+                closed = self.closed
+            if closed:
+                break
+            now = time.monotonic()
+            for handler in parked:
+                self.selector.register(handler.connection, selectors.EVENT_READ)
+                idle[handler.connection] = handler, now
+            expired = []
+            for connection, (handler, since) in idle.items():
+                if now - since < self.idle_timeout:
+                    break
+                expired.append(connection)
+            for connection in expired:
+                self.selector.unregister(connection)
+                self.close_idle(idle.pop(connection)[0])
+            timeout = next(iter(idle.values()))[1] + self.idle_timeout - now if idle else None
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.wakeup:
+                    self.wakeup.recv(4096)
+                    continue
+                self.selector.unregister(key.fileobj)
+                handler, _ = idle.pop(key.fileobj)
+                self.dispatch(self.process_idle_thread, key.fileobj, handler)
+        for handler, _ in idle.values():
+            self.close_idle(handler)
+        self.selector.close()
+        self.wakeup.close()
+
+    def server_close(self) -> None:
+        super().server_close()
+        with self.idle_lock:
+            self.closed = True
+            parked, self.parked = self.parked, []
+        self.wakeup_sender.close()  # Wakes up the watching thread, which closes the idle connections
+        for handler in parked:
+            self.close_idle(handler)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def make_server(server_address, handler_class, workers=8, idle_timeout=IDLE_TIMEOUT) -> HTTPServer:
+    """
+    Create the HTTP server for the given concurrency
+    :param workers: Number of worker threads, 1 or less handles one request at a time
+    :param idle_timeout: Seconds a kept alive connection may wait for its next request
+    :return: The server, not yet serving
+    """
+    return PooledHTTPServer(server_address, handler_class, workers=max(1, workers), idle_timeout=idle_timeout)
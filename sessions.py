@@ -0,0 +1,211 @@
+from batching import MessageOrder
+import compute
+from encryption import Encryption
+from keyagreement import KeyAgreement, get_backend
+from keypool import KeyPool
+import protocol
+from tickets import TicketCache
+import tickets
+import metrics
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class Session:
+    """
+    State of a single key exchange with a remote peer, kept small as a server can hold many
+    """
+    __slots__ = ("g", "p", "mode", "kex", "secret", "public", "remote_public", "shared_secret", "state", "last_seen", "_cipher", "order")
+
+    def __init__(self, g: int, p: int, mode="eax", kex="modp"):
+        self.g = g  # Shared generator g
+        self.p = p  # Shared prime p
+        self.mode = mode  # AEAD mode for messages
+        self.kex = kex  # Key agreement, 'modp' or an elliptic curve
+        self.secret = -1  # Own secret key
+        self.public = -1  # Own public key
+        self.remote_public = -1  # Remote public key
+        self.shared_secret = -1  # Shared key K
+        self.state = ""  # Last state requested by the peer
+        self.last_seen = time.monotonic()  # Time of the last request, used for idle eviction
+        self._cipher = None  # Encryption for the shared key, built on first use
+        self.order = None  # Puts received messages back in the order they were sent, created with the first numbered message
+
+    @property
+    def cipher(self) -> Encryption:
+        """
+        :return: Encryption for the shared secret, reused for every message of the session
+        """
+        if self._cipher is None:
+            self._cipher = Encryption(self.shared_secret, self.mode)
+        return self._cipher
+
+
+class SessionTable:
+    """
+    Key exchanges with many peers, keyed by the session ID sent with every request
+    Sessions are answered automatically, with a random secret key for each session
+    """
+
+    def __init__(self, max_sessions=10000, idle_timeout=300.0, on_message=None, keypool: KeyPool = None,
+                 tickets: TicketCache = None, compute=compute.INLINE):
+        self.max_sessions = max_sessions  # Largest number of sessions kept, the least recently used is evicted first
+        self.idle_timeout = idle_timeout  # Seconds without requests before a session is evicted
+        self.on_message = on_message  # Called with the session ID and a list of received messages, if given
+        self.keypool = keypool  # Precomputed key pairs for our side of each session, if given
+        self.tickets = tickets  # Resumption tickets of completed sessions, if given
+        self.compute = compute  # Runs key calculations and large decryptions, in worker processes if it is a ComputeExecutor
+
+        self.sessions = OrderedDict()  # Sessions ordered from least to most recently used
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, session_id: str) -> Session | None:
+        """
+        :return: The session, marked as used, or None if it does not exist
+        """
+        with self.lock:
+            self.evict()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_seen = time.monotonic()
+                self.sessions.move_to_end(session_id)
+            return session
+
+    def create(self, session_id: str, g: int, p: int, mode="eax", kex="modp") -> Session:
+        """
+        Create a session, replacing any existing session with the same ID
+        :return: The new session
+        """
+        session = Session(g, p, mode, kex)
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            self.sessions[session_id] = session
+            self.evict()
+        return session
+
+    def evict(self) -> None:
+        """
+        Remove idle sessions, and the least recently used sessions above the size limit
+        Must be called with the lock held
+        """
+        oldest = time.monotonic() - self.idle_timeout
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.last_seen >= oldest and len(self.sessions) <= self.max_sessions:
+                break
+            self.sessions.popitem(last=False)
+
+    def agreement(self, session: Session) -> KeyAgreement:
+        """
+        :return: Backend for the key agreement of a session, only trusted by the key pool for standard groups and curves
+        """
+        if self.keypool is not None:
+            return self.keypool.agreement(session.kex, session.g, session.p)
+        return get_backend(session.kex, session.g, session.p)
+
+    def receive_messages(self, session_id: str, session: Session, msgs: list, seq: int = None) -> None:
+        """
+        Pass received messages of a session to on_message, in the order they were sent if they have a sequence number
+        """
+        if self.on_message is None:
+            return
+        if seq is None:
+            self.on_message(session_id, msgs)
+            return
+        with self.lock:
+            if session.order is None:
+                session.order = MessageOrder(lambda msgs: self.on_message(session_id, msgs))
+            order = session.order
+        order.receive(seq, msgs)
+
+    def receive_request(self, data: dict, response: dict) -> dict:
+        """
+        Answer a request that belongs to a session
+        :param data: The request data, including the session ID
+        :param response: The response to fill in
+        :return: The JSON response
+        """
+        session_id = data["session"]
+        if data["type"] in ("shared", "handshake"):  # A new exchange, with new shared parameters
+            negotiated = protocol.negotiate(data, response)
+            if negotiated is None:
+                return response
+            if data["type"] == "handshake" and "public" not in data:
+                response["error"] = "Missing parameters"
+                return response
+            kex, mode = negotiated
+            session = self.create(session_id, data.get("g", -1), data.get("p", -1), mode, kex)
+            if data["type"] == "shared":
+                if self.keypool is not None:
+                    self.keypool.prepare(self.agreement(session))  # Key pairs are ready by the time the public key arrives
+                response["success"] = True
+                return response
+            session.state = "messaging"  # A handshake also starts the chat, and is answered like a public key
+
+        if data["type"] == "resume":  # A new session continuing an earlier exchange, with a key derived from its ticket
+            if self.tickets is None:
+                response["error"] = "Resumption is not supported"
+                return response
+            resumed = tickets.answer(self.tickets, data, response)
+            if resumed is None:
+                return response
+            session = self.create(session_id, -1, -1, resumed[1])
+            session.shared_secret = resumed[0]
+            session.state = "messaging"
+            self.tickets.issue(session.shared_secret, session.mode, log_key=resumed[2])  # Still the same conversation
+            return response
+
+        session = self.get(session_id)
+        if session is None:
+            response["error"] = "Unknown session"
+            return response
+
+        match data["type"]:
+            case "public" | "handshake":
+                if "public" not in data:
+                    response["error"] = "Missing parameters"
+                    return response
+                agreement = self.agreement(session)
+                if session.public == -1:  # Pick our own key pair for this session
+                    with metrics.KEX_SECONDS.time("public", session.kex):
+                        if self.keypool is not None:
+                            session.secret, session.public = self.keypool.take(agreement)
+                        else:
+                            session.secret, session.public = self.compute.run(compute.keypair, agreement)
+                session.remote_public = data["public"]
+                with metrics.KEX_SECONDS.time("shared", session.kex):
+                    session.shared_secret = self.compute.run(agreement.shared_secret, session.secret, session.remote_public)
+                session._cipher = None
+                session.order = None  # Sequence numbers start over with the new key
+                if self.tickets is not None:
+                    self.tickets.issue(session.shared_secret, session.mode)
+                response["status"] = "complete"
+                response["public"] = session.public
+                response["success"] = True
+
+            case "set_state":
+                state = protocol.check_state(data, response)
+                if state is None:
+                    return response
+                session.state = state
+                response["success"] = True
+
+            case "message" | "message_batch":
+                checked = protocol.check_messages(data, response)
+                if checked is None:
+                    return response
+                if session.shared_secret == -1:
+                    response["error"] = "Key exchange not complete"
+                    return response
+                msgs, seq = checked
+                self.receive_messages(session_id, session, [protocol.decrypt(session.cipher, msg, self.compute) for msg in msgs], seq)
+                response["success"] = True
+
+            case _:
+                return protocol.invalid_type(response)
+        return response
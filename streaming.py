@@ -0,0 +1,139 @@
+"""
+Encrypted streaming of files, one authenticated frame per chunk, so neither side holds more than a chunk in memory
+
+The stream starts with a random stream ID (16 bytes), followed by one frame per chunk, each laid out as:
+    ciphertext length (4 bytes) | flags (1 byte) | nonce length (1 byte) | nonce | tag (16 bytes) | ciphertext
+The stream ID, the chunk index, the flags and the file name are authenticated with each chunk, so chunks can't be reordered, dropped,
+cut off, renamed or spliced in from another stream under the same key.
+"""
+from encryption import Encryption
+
+import secrets
+import struct
+
+CONTENT_TYPE = "application/x-dh-stream"
+CHUNK_SIZE = 64 * 1024  # Default plaintext size of each chunk
+MAX_CHUNK_SIZE = 16 * 1024 * 1024  # Largest chunk accepted from the remote user
+TAG_SIZE = 16
+STREAM_ID_SIZE = 16
+
+FINAL = 0x01  # Flag set on the last chunk of a stream
+
+_FRAME = struct.Struct(">IBB")  # Ciphertext length, flags and nonce length
+_HEADER = struct.Struct(">16sQB")  # Stream ID, chunk index and flags, authenticated with each chunk followed by the file name
+
+
+def encrypt_stream(cipher: Encryption, file, chunk_size=CHUNK_SIZE, name=b""):
+    """
+    Read and encrypt a file one chunk at a time
+    :param cipher: Encryption for the shared key
+    :param file: File object opened in binary mode
+    :param chunk_size: Plaintext bytes per chunk
+    :param name: File name as sent to the remote user, authenticated with every chunk
+    :return: Generator of the stream ID and the encrypted frames
+    """
+    stream_id = secrets.token_bytes(STREAM_ID_SIZE)
+    yield stream_id
+    index = 0
+    chunk = file.read(chunk_size)
+    while True:
+        next_chunk = file.read(chunk_size)  # Read ahead, to know if this is the last chunk
+        flags = 0 if next_chunk else FINAL
+        ct, tag, nonce = cipher.encrypt_bytes(chunk, header=_HEADER.pack(stream_id, index, flags) + name)
+        yield _FRAME.pack(len(ct), flags, len(nonce)) + nonce + tag + ct
+        if flags & FINAL:
+            return
+        chunk = next_chunk
+        index += 1
+
+
+def decrypt_stream(cipher: Encryption, read, out, name=b"") -> int:
+    """
+    Decrypt a stream of frames, writing each chunk as soon as it is verified
+    :param cipher: Encryption for the shared key
+    :param read: Function reading exactly n bytes, or fewer at the end of the stream
+    :param out: File object opened in binary mode, to write the plaintext to
+    :param name: File name as received, which the sender authenticated with every chunk
+    :return: Number of plaintext bytes written
+    """
+    stream_id = read(STREAM_ID_SIZE)
+    if len(stream_id) < STREAM_ID_SIZE:
+        raise ValueError("Stream ended before the stream ID")
+    index = 0
+    written = 0
+    while True:
+        frame = read(_FRAME.size)
+        if len(frame) < _FRAME.size:
+            raise ValueError("Stream ended before the final chunk")
+        length, flags, nonce_length = _FRAME.unpack(frame)
+        if length > MAX_CHUNK_SIZE:
+            raise ValueError("Chunk too large")
+        body = read(nonce_length + TAG_SIZE + length)
+        if len(body) < nonce_length + TAG_SIZE + length:
+            raise ValueError("Stream ended before the final chunk")
+        body = memoryview(body)
+        nonce, tag, ct = body[:nonce_length], body[nonce_length:nonce_length + TAG_SIZE], body[nonce_length + TAG_SIZE:]
+
+        chunk = cipher.decrypt_bytes(ct, tag, nonce, header=_HEADER.pack(stream_id, index, flags) + name)
+        if chunk is False:
+            raise ValueError(f"Chunk {index} failed verification")
+        out.write(chunk)
+        written += len(chunk)
+        if flags & FINAL:
+            if read(1):
+                raise ValueError("Data after the final chunk")
+            return written
+        index += 1
+
+
+class ChunkedReader:
+    """
+    Reads the body of a request sent with chunked transfer encoding
+    """
+
+    def __init__(self, rfile):
+        self.rfile = rfile
+        self.remaining = 0  # Bytes left of the current chunk
+        self.done = False  # True once the last chunk has been read
+
+    def read(self, n: int) -> bytes:
+        """
+        :return: The next n bytes of the body, or fewer at the end of the body
+        """
+        parts = []
+        while n > 0 and not self.done:
+            if self.remaining == 0:
+                size = int(self.rfile.readline(65537).split(b";")[0].strip(), 16)  # Chunk size, ignoring extensions
+                if size == 0:
+                    while self.rfile.readline(65537) not in (b"\r\n", b"\n", b""):  # Skip any trailers
+                        pass
+                    self.done = True
+                    break
+                self.remaining = size
+            data = self.rfile.read(min(n, self.remaining))
+            if not data:
+                raise ValueError("Connection closed during the body")
+            parts.append(data)
+            self.remaining -= len(data)
+            n -= len(data)
+            if self.remaining == 0:
+                self.rfile.readline(3)  # CRLF ending the chunk
+        return b"".join(parts)
+
+
+class LengthReader:
+    """
+    Reads the body of a request sent with a Content-Length
+    """
+
+    def __init__(self, rfile, length: int):
+        self.rfile = rfile
+        self.remaining = length  # Bytes left of the body
+
+    def read(self, n: int) -> bytes:
+        """
+        :return: The next n bytes of the body, or fewer at the end of the body
+        """
+        data = self.rfile.read(min(n, self.remaining))
+        self.remaining -= len(data)
+        return data
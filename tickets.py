@@ -0,0 +1,151 @@
+"""
+Resumption tickets, so a peer that has completed an exchange can agree on a new key in one round trip
+
+After an exchange both sides derive the same ticket ID and resumption key from the shared secret, so no ticket has to be sent.
+To resume, the client sends the ticket ID and a nonce, the server answers with its own nonce, and both derive a new shared secret
+from the resumption key and both nonces. Each side proves it holds the resumption key with a binder over the nonces.
+Tickets are used once, the resumed exchange issues the next ticket.
+"""
+import messagelog
+import wire
+
+from Crypto.Hash import HMAC, SHA256
+from Crypto.Protocol.KDF import HKDF
+from Crypto.Random import get_random_bytes
+
+from collections import OrderedDict
+import hmac
+import threading
+import time
+
+NONCE_SIZE = 16
+
+
+class Ticket:
+    __slots__ = ("key", "mode", "log_key", "expires")
+
+    def __init__(self, key: bytes, mode: str, log_key: bytes, expires: float):
+        self.key = key  # Resumption key, never the shared secret itself
+        self.mode = mode  # AEAD mode of the exchange, kept for the resumed exchange
+        self.log_key = log_key  # Key of the conversation's message log, kept so the resumed exchange writes to the same log
+        self.expires = expires  # Monotonic time the ticket can no longer be used
+
+
+def _secret_bytes(shared_secret: int) -> bytes:
+    return shared_secret.to_bytes((shared_secret.bit_length() + 7) // 8 or 1, "big")
+
+
+def derive(shared_secret: int) -> tuple[str, bytes]:
+    """
+    :return: The ticket ID and resumption key of a shared secret
+    """
+    material = HKDF(_secret_bytes(shared_secret), 48, b"", SHA256, context=b"DH_Demo resumption")
+    return material[:16].hex(), material[16:]
+
+
+def resumed_secret(key: bytes, client_nonce: bytes, server_nonce: bytes) -> int:
+    """
+    :return: The shared secret of a resumed exchange
+    """
+    return int.from_bytes(HKDF(key, 32, client_nonce + server_nonce, SHA256, context=b"DH_Demo resumed secret"), "big")
+
+
+def binder(key: bytes, role: bytes, *nonces: bytes) -> bytes:
+    """
+    :param role: b'client' or b'server', so one side's binder can't be replayed as the other's
+    :return: Proof of holding the resumption key, bound to the nonces of the resumption
+    """
+    mac = HMAC.new(key, role, digestmod=SHA256)
+    for nonce in nonces:
+        mac.update(nonce)
+    return mac.digest()
+
+
+def verify_binder(expected: bytes, received: bytes) -> bool:
+    return hmac.compare_digest(expected, bytes(received))
+
+
+class TicketCache:
+    """
+    Tickets of recent exchanges, the oldest is dropped when the cache is full
+    """
+
+    def __init__(self, max_tickets=1024, lifetime=3600.0):
+        self.max_tickets = max_tickets  # Largest number of tickets kept
+        self.lifetime = lifetime  # Seconds a ticket can be used for
+        self.tickets = OrderedDict()  # Ticket ID: Ticket, from oldest to newest
+        self.peers = {}  # Remote user: ID of the last ticket with them, to know which ticket to present
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.tickets)
+
+    def issue(self, shared_secret: int, mode: str, peer=None, log_key: bytes = None) -> str:
+        """
+        Store the ticket of a completed exchange
+        :param shared_secret: The shared key K of the exchange
+        :param mode: AEAD mode of the exchange
+        :param peer: Remote user to remember the ticket for, when we are the one who resumes
+        :param log_key: Log key of the conversation, derived from the shared key if this exchange started it
+        :return: The ticket ID
+        """
+        ticket_id, key = derive(shared_secret)
+        ticket = Ticket(key, mode, log_key or messagelog.log_key(shared_secret), time.monotonic() + self.lifetime)
+        with self.lock:
+            self.tickets.pop(ticket_id, None)
+            self.tickets[ticket_id] = ticket
+            while len(self.tickets) > self.max_tickets:
+                self.tickets.popitem(last=False)
+            if peer is not None:
+                self.peers[peer] = ticket_id
+        return ticket_id
+
+    def take(self, ticket_id: str) -> Ticket | None:
+        """
+        Remove a ticket to use it
+        :return: The ticket, or None if it is unknown or expired
+        """
+        with self.lock:
+            ticket = self.tickets.pop(ticket_id, None)
+        if ticket is None or ticket.expires < time.monotonic():
+            return None
+        return ticket
+
+    def for_peer(self, peer) -> str | None:
+        """
+        :return: ID of the last ticket with a remote user, if it is still usable
+        """
+        with self.lock:
+            ticket_id = self.peers.get(peer)
+            ticket = self.tickets.get(ticket_id)
+            if ticket is None or ticket.expires < time.monotonic():
+                self.peers.pop(peer, None)
+                return None
+            return ticket_id
+
+
+def answer(cache: TicketCache, data: dict, response: dict) -> tuple[int, str, bytes] | None:
+    """
+    Answer a 'resume' request as the server
+    :param cache: Tickets of our completed exchanges
+    :param data: The request data, with the ticket ID, the client nonce and the client binder
+    :param response: The response to fill in with our nonce and binder
+    :return: The new shared secret, the AEAD mode and the log key, or None if the ticket can't be used
+    """
+    if "ticket" not in data or "nonce" not in data or "binder" not in data:
+        response["error"] = "Missing parameters"
+        return None
+    ticket = cache.take(str(data["ticket"]))
+    if ticket is None:  # The client falls back to a full exchange
+        response["error"] = "Unknown ticket"
+        return None
+    client_nonce = bytes(wire.as_bytes(data["nonce"]))
+    if len(client_nonce) != NONCE_SIZE or not verify_binder(binder(ticket.key, b"client", client_nonce), wire.as_bytes(data["binder"])):
+        response["error"] = "Invalid ticket"
+        return None
+    server_nonce = get_random_bytes(NONCE_SIZE)
+    response["nonce"] = server_nonce
+    response["binder"] = binder(ticket.key, b"server", client_nonce, server_nonce)
+    response["mode"] = ticket.mode
+    response["success"] = True
+    return resumed_secret(ticket.key, client_nonce, server_nonce), ticket.mode, ticket.log_key
@@ -0,0 +1,196 @@
+"""
+Spans of the key exchange phases and messages, kept in a ring buffer and written to a trace file by a background thread
+
+The trace file uses the Chrome trace event format, so it opens as a timeline in chrome://tracing or ui.perfetto.dev.
+When tracing is off, starting a span is a level check that returns a shared no-op span.
+"""
+from collections import deque
+import atexit
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+DEBUG = 10  # Every request and message
+INFO = 20  # Handshake phases
+WARNING = 30  # Failures only
+OFF = 100
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "off": OFF}
+
+
+class _NoopSpan:
+    """
+    Span returned when tracing is off or the span was not sampled
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key: str, value) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "attrs", "id", "parent", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs  # Recorded with the span, never key material
+        self.id = next(tracer.ids)
+        self.parent = None  # Span that was open on the same thread when this one started
+        self.start = 0
+
+    def set(self, key: str, value) -> None:
+        """
+        Add an attribute to the span, such as the outcome of the phase
+        """
+        self.attrs[key] = value
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1].id if stack else None
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        self.tracer.stack().pop()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.attrs["id"] = self.id
+        if self.parent is not None:
+            self.attrs["parent"] = self.parent
+        self.tracer.record({
+            "name": self.name, "ph": "X", "ts": self.tracer.timestamp(self.start), "dur": (end - self.start) / 1000,
+            "pid": self.tracer.pid, "tid": threading.get_ident(), "args": self.attrs,
+        })
+        return False
+
+
+class Tracer:
+    def __init__(self, level=OFF, sample_rate=1.0, capacity=65536, flush_interval=0.5):
+        self.level = level  # Spans below this level are not recorded
+        self.sample_rate = sample_rate  # Fraction of spans that are recorded
+        self.buffer = deque(maxlen=capacity)  # Finished spans waiting to be written, the oldest are dropped when full
+        self.flush_interval = flush_interval  # Seconds between writes to the trace file
+        self.ids = itertools.count(1)
+        self.pid = os.getpid()
+        self.local = threading.local()  # Stack of open spans of each thread
+        # perf_counter is precise but has no epoch, so it is anchored to the wall clock once
+        self.epoch_ns = time.time_ns() - time.perf_counter_ns()
+        self.file = None
+        self.thread = None
+        self.wake = threading.Event()
+        self.closed = False
+
+    def span(self, name: str, level=INFO, **attrs):
+        """
+        Start a span, to be used as a context manager
+        :param name: Name of the phase, such as 'send.public'
+        :param level: DEBUG, INFO or WARNING
+        :param attrs: Attributes recorded with the span
+        :return: The span, or a no-op span if it is not recorded
+        """
+        if level < self.level or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def event(self, name: str, level=INFO, **attrs) -> None:
+        """
+        Record an instant event, such as a failed connection
+        """
+        if level < self.level:
+            return
+        self.record({
+            "name": name, "ph": "i", "s": "t", "ts": self.timestamp(time.perf_counter_ns()),
+            "pid": self.pid, "tid": threading.get_ident(), "args": attrs,
+        })
+
+    def enabled(self, level=INFO) -> bool:
+        return level >= self.level
+
+    def stack(self) -> list:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def timestamp(self, perf_ns: int) -> float:
+        """
+        :return: Microseconds since the epoch, as used by the trace event format
+        """
+        return (self.epoch_ns + perf_ns) / 1000
+
+    def record(self, event: dict) -> None:
+        self.buffer.append(event)  # deque.append is thread safe, so the request thread never waits for the writer
+
+    def open(self, path: str) -> None:
+        """
+        Write recorded spans to a trace file from a background thread
+        """
+        self.file = open(path, "w")
+        self.file.write("[\n")  # The closing bracket is optional in the trace event format, so the file is valid at any point
+        self.thread = threading.Thread(target=self.run, name="tracer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def run(self) -> None:
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write every recorded span to the trace file
+        """
+        if self.file is None:
+            return
+        lines = []
+        while self.buffer:
+            try:
+                lines.append(json.dumps(self.buffer.popleft(), default=str) + ",\n")
+            except IndexError:
+                break
+        if lines:
+            self.file.write("".join(lines))
+            self.file.flush()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+
+
+TRACER = Tracer()
+
+
+def configure(path=None, level="info", sample_rate=1.0) -> Tracer:
+    """
+    Turn on tracing for the process
+    :param path: Trace file to write to, spans are only kept in memory without it
+    :param level: 'debug', 'info', 'warning' or 'off'
+    :param sample_rate: Fraction of spans to record
+    :return: The process wide tracer
+    """
+    TRACER.level = LEVELS[level]
+    TRACER.sample_rate = sample_rate
+    if path is not None and TRACER.file is None:
+        TRACER.open(path)
+    return TRACER
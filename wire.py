@@ -0,0 +1,120 @@
+"""
+Compact binary framing of requests, used instead of JSON when the Content-Type is CONTENT_TYPE
+
+A frame is a sequence of fields, each laid out as:
+    key length (1 byte) | key (utf-8) | value type (1 byte) | value length (4 bytes, big endian) | value
+Ints are stored as signed big endian bytes, and bytes are stored raw, so keys and ciphertexts are not hex encoded.
+"""
+import struct
+
+CONTENT_TYPE = "application/x-dh-frame"
+
+_HEADER = struct.Struct(">cI")  # Value type and value length
+_LENGTH = struct.Struct(">I")
+
+_INT = b"i"
+_STR = b"s"
+_BYTES = b"b"
+_BOOL = b"t"
+_NONE = b"n"
+_DICT = b"d"
+_LIST = b"l"
+
+
+def encode(data: dict) -> bytes:
+    """
+    Encode a request or response as a binary frame
+    :param data: Dict with str keys, and int, str, bytes, bool, None, dict or list of dict values
+    :return: The encoded frame
+    """
+    parts = []
+    for key, value in data.items():
+        key = key.encode("utf-8")
+        if isinstance(value, bool):  # Checked before int, as bool is a subclass of int
+            kind, value = _BOOL, b"\x01" if value else b"\x00"
+        elif isinstance(value, int):
+            kind, value = _INT, value.to_bytes(value.bit_length() // 8 + 1, "big", signed=True)
+        elif isinstance(value, str):
+            kind, value = _STR, value.encode("utf-8")
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            kind = _BYTES
+        elif value is None:
+            kind, value = _NONE, b""
+        elif isinstance(value, dict):
+            kind, value = _DICT, encode(value)
+        elif isinstance(value, list):
+            kind, value = _LIST, b"".join(_LENGTH.pack(len(item)) + item for item in map(encode, value))
+        else:
+            raise TypeError(f"Cannot encode {type(value).__name__} in a frame")
+        parts += [bytes((len(key),)), key, _HEADER.pack(kind, len(value)), value]
+    return b"".join(parts)
+
+
+def decode(frame: bytes | memoryview) -> dict:
+    """
+    Decode a binary frame, without copying the bytes values
+    :param frame: The encoded frame
+    :return: The decoded dict, where bytes values are memoryview slices of the frame
+    """
+    view = memoryview(frame)
+    data = {}
+    pos = 0
+    while pos < len(view):
+        key_length = view[pos]
+        key = bytes(view[pos + 1:pos + 1 + key_length]).decode("utf-8")
+        pos += 1 + key_length
+        kind, length = _HEADER.unpack_from(view, pos)
+        pos += _HEADER.size
+        value = view[pos:pos + length]
+        if len(value) != length:
+            raise ValueError("Truncated frame")
+        pos += length
+
+        match kind:
+            case b"i":
+                data[key] = int.from_bytes(value, "big", signed=True)
+            case b"s":
+                data[key] = str(value, "utf-8")
+            case b"b":
+                data[key] = value
+            case b"t":
+                data[key] = value[0] != 0
+            case b"n":
+                data[key] = None
+            case b"d":
+                data[key] = decode(value)
+            case b"l":
+                data[key] = list(_decode_list(value))
+            case _:
+                raise ValueError(f"Unknown value type {kind!r}")
+    return data
+
+
+def _decode_list(view: memoryview):
+    """
+    Decode the length prefixed frames of a list value
+    """
+    pos = 0
+    while pos < len(view):
+        (length,) = _LENGTH.unpack_from(view, pos)
+        pos += _LENGTH.size
+        yield decode(view[pos:pos + length])
+        pos += length
+
+
+def to_hex(value) -> str:
+    """
+    JSON fallback for bytes values, which are sent as hex strings
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return value.hex()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def as_bytes(value: str | bytes | memoryview) -> bytes | memoryview:
+    """
+    :return: Raw bytes of a value received as hex in JSON, or as bytes in a frame
+    """
+    if isinstance(value, str):
+        return bytes.fromhex(value)
+    return value